@@ -0,0 +1,38 @@
+import numpy as np
+import os
+import re
+
+from wildcard.model.game import Game
+from wildcard.scripts.basic_stats import num_intervals
+from wildcard.scripts.basic_stats import process_transcript
+from wildcard.util.cards import Tokenizer
+
+
+def replay_stats(transcript_file, tokenizer):
+    """
+    Stats of process_transcript() computed by replaying Game.all_moves
+    """
+    moves = Game(transcript_file, cache=False).all_moves
+    tokens = set()
+    message_histogram = np.zeros(num_intervals)
+    interval_bins = np.rint(np.linspace(0, len(moves), num_intervals + 1))
+    num_messages = 0
+    for idx, move in enumerate(moves):
+        if move.message is not None:
+            num_messages += 1
+            tokens.update([tok.lower() for tok in tokenizer.tokenize(re.sub("--", "", move.message))])
+            message_histogram[np.searchsorted(interval_bins, idx, side="right") - 1] += 1
+    return tokens, len(moves), num_messages, message_histogram
+
+
+if __name__ == "__main__":
+    tokenizer = Tokenizer()
+    transcript_file = os.path.join(os.path.dirname(os.path.abspath(".")),
+                                   "data/CardsCorpus-v02/transcripts/01/cards_0000001.csv")
+
+    tokens, num_moves, num_messages, message_histogram = process_transcript(transcript_file, tokenizer)
+    replay_tokens, replay_moves, replay_messages, replay_histogram = replay_stats(transcript_file, tokenizer)
+    print "Num moves: ", num_moves, replay_moves
+    print "Num messages: ", num_messages, replay_messages
+    print "Same tokens? ", tokens == replay_tokens
+    print "Same histogram? ", np.array_equal(message_histogram, replay_histogram)
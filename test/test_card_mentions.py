@@ -0,0 +1,22 @@
+from wildcard.util.card_mentions import CardRecognizer
+
+
+if __name__ == "__main__":
+    recognizer = CardRecognizer()
+
+    utterance = "I have the four of hearts and 10S"
+    print recognizer.find(utterance)
+    print recognizer.cards(utterance)
+
+    utterance = "need more hearts"
+    print recognizer.cards(utterance)
+
+    utterance = "got it"
+    print "Mentions card? ", recognizer.mentions_card(utterance)
+
+    # "as" is a word here, but the ace of spades next to another card
+    utterance = "as soon as you can"
+    print recognizer.cards(utterance)
+
+    utterance = "I have the kd and as"
+    print recognizer.cards(utterance)
@@ -0,0 +1,25 @@
+import os
+
+from wildcard.util.cards import Corpus
+from wildcard.util.cards import Transcript
+from wildcard.util.corpus_cache import CorpusCache
+
+
+if __name__ == "__main__":
+    corpus_dir = os.path.join(os.path.dirname(os.path.abspath(".")), "data/CardsCorpus-v02/transcripts")
+    cache = CorpusCache.compile(corpus_dir)
+    print "Fresh? ", cache.is_fresh()
+
+    # Cached and CSV transcripts should agree event for event
+    transcript = cache.filenames[0]
+    cached = [repr(e) for e in Transcript(transcript, cache=cache).events]
+    parsed = [repr(e) for e in Transcript(transcript, cache=False).events]
+    print "Same events? ", cached == parsed
+
+    corpus = Corpus(corpus_dir)
+    print "Transcripts: ", sum(1 for _ in corpus.iter_transcripts())
+
+    # Memory-mapped views behave like Events
+    views = Transcript(transcript, cache=cache, views=True).events
+    print "Same views? ", [repr(e) for e in views] == parsed
+    print "Events: ", sum(1 for _ in corpus.iter_events(views=True))
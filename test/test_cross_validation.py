@@ -0,0 +1,18 @@
+from wildcard.model.cross_validation import cross_validate
+from wildcard.model.cross_validation import format_table
+from wildcard.model.cross_validation import group_kfold_indices
+from wildcard.model.cross_validation import summarize
+from wildcard.util.parse_annotations import parse_all
+
+
+if __name__ == "__main__":
+    annotation_dir = "../data/annotations_reworked"
+    utterances = parse_all(annotation_dir, verbose=False)
+
+    folds = group_kfold_indices([ex["TRANSCRIPT"] for ex in utterances], 5)
+    for fold in folds:
+        print "Fold size: ", len(fold), " transcripts: ", \
+            sorted(set(utterances[i]["TRANSCRIPT"] for i in fold))
+
+    results = cross_validate(utterances, k=5, processes=None)
+    print format_table(summarize(results))
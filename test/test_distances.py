@@ -0,0 +1,22 @@
+import numpy as np
+
+from wildcard.model.board import parse_board
+from wildcard.model.distances import DistanceEngine
+
+
+if __name__ == "__main__":
+    board = parse_board(["    ",
+                         " -- ",
+                         " -b ",
+                         "    "])
+    engine = DistanceEngine(board)
+    print engine.distance((0, 0), (3, 3))
+    print engine.distance((0, 1), (3, 1))
+    # Wall cells cannot be reached
+    print engine.distance((0, 0), (1, 1))
+
+    layout = {(0, 3): ["4H"], (3, 0): ["KS", "2H"]}
+    print engine.card_distances((0, 0), layout)
+    print engine.nearest_card((3, 3), layout)
+    print engine.nearest_card((3, 3), layout, suit="S")
+    print np.array_equal(engine.all_pairs()[0], engine.distances_from((0, 0)))
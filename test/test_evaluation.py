@@ -0,0 +1,16 @@
+import numpy as np
+
+from sklearn.metrics import confusion_matrix
+from wildcard.model.evaluation import confusion_counts
+from wildcard.model.evaluation import evaluate_predictions
+
+
+if __name__ == "__main__":
+    gold = np.array([1, 0, 1, 1, 0, 0, 1, 0])
+    predicted = np.array([1, 0, 0, 1, 1, 0, 1, 0])
+    print "Confusion: ", confusion_counts(gold, predicted)
+    print "sklearn confusion: ", confusion_matrix(gold, predicted)
+
+    results = evaluate_predictions(gold, predicted, positive_prior=0.5, resamples=2000)
+    for name in ("model", "random_baseline", "majority_baseline"):
+        print name, results[name]["metrics"], results[name].get("ci")
@@ -2,6 +2,7 @@ from wildcard.util.model_utils import compute_ed
 from wildcard.util.model_utils import compute_window
 from wildcard.util.model_utils import free_hand
 from wildcard.util.model_utils import free_hand_2
+from wildcard.util.model_utils import Hand
 
 
 if __name__ == "__main__":
@@ -50,3 +51,9 @@ if __name__ == "__main__":
     coi = "QH"
     hands = {"1": [""], "2": [""]}
     print compute_ed(hands, coi)
+
+    # Bitmask hands
+    hand = Hand.from_cards(["3H", "4H", "10H"])
+    print hand, len(hand), "4H" in hand
+    print "Free?", free_hand_2(hand)
+    print "Hearts: ", hand.suit("H"), " Spades: ", hand.suit("S")
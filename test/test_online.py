@@ -0,0 +1,26 @@
+from wildcard.model.cg_model import CGModel
+from wildcard.model.online import OnlinePredictor
+from wildcard.util.data_utils import split_data
+from wildcard.util.parse_annotations import parse_all
+
+
+if __name__ == "__main__":
+    annotation_dir = "../data/annotations_reworked"
+    utterances = parse_all(annotation_dir, verbose=False)
+    train_data, test_data = split_data(utterances)
+    model = CGModel()
+    model.train(train_data)
+
+    # Online scores of every turn should match the batch scores of the examples
+    x, x_text, _ = model._featurize(test_data)
+    _, _, batch_scores = model.predict(x, x_text)
+    predictor = OnlinePredictor(model)
+    online_scores = {}
+    for ex in test_data:
+        buffer = ex["DIALOGUE_CONTEXT"].buffer
+        if id(buffer) not in predictor.dialogues:
+            for end, turn in enumerate(buffer.turns, 1):
+                online_scores[(id(buffer), end)] = predictor.observe(id(buffer), turn)[0]
+    print "Max difference: ", max(abs(online_scores[(id(ex["DIALOGUE_CONTEXT"].buffer), ex["DIALOGUE_CONTEXT"].end)] - score)
+                                  for ex, score in zip(test_data, batch_scores))
+    print predictor.latency.format()
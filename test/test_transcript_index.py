@@ -0,0 +1,27 @@
+import os
+
+from collections import Counter
+from wildcard.util.cards import Corpus
+from wildcard.util.cards import MOVE
+from wildcard.util.cards import Transcript
+from wildcard.util.cards import UTTERANCE
+
+
+if __name__ == "__main__":
+    corpus_dir = os.path.join(os.path.dirname(os.path.abspath(".")), "data/CardsCorpus-v02/transcripts")
+    corpus = Corpus(corpus_dir)
+
+    # The index should answer the same as filtering events one by one
+    for transcript in corpus.iter_transcripts(display_progress=False):
+        events = transcript.events
+        print transcript.filename
+        print "Same counts? ", transcript.count_by_action() == Counter(e.action for e in events)
+
+        t0, t1 = events[len(events) // 4].time, events[3 * len(events) // 4].time
+        for action in (None, UTTERANCE, MOVE):
+            linear = [e for e in events if t0 <= e.time < t1 and action in (None, e.action)]
+            print "Same events between? ", action, transcript.events_between(t0, t1, action) == linear
+
+        lazy = Transcript(transcript.filename, cache=False, lazy=True)
+        print "Same lazy utterances? ", \
+            [repr(e) for e in lazy.events_of(UTTERANCE)] == [repr(e) for e in events if e.action == UTTERANCE]
@@ -0,0 +1,34 @@
+import os
+import tempfile
+
+from wildcard.model.board import parse_board
+from wildcard.model.game import Game
+from wildcard.model.visibility import VisibilityEngine
+
+
+if __name__ == "__main__":
+    board = parse_board(["     ",
+                         "  -  ",
+                         "     "])
+    engine = VisibilityEngine(board, radius=2)
+    # The wall hides the cell behind it
+    print engine.can_see((1, 0), (1, 4))
+    print engine.can_see((1, 0), (1, 2))
+    print engine.visible_cells((0, 0))
+
+    layout = {(0, 2): ["4H"], (2, 4): ["KS"]}
+    print engine.visible_cards((0, 1), layout)
+
+    # A transcript without sight radii has no visible cards to report
+    transcript = os.path.join(os.path.dirname(os.path.abspath(".")), "data/CardsCorpus-v02/transcripts/01/cards_0000001.csv")
+    with open(transcript) as f:
+        lines = [line for line in f if "_MAX_LINEOFSIGHT" not in line]
+    handle, stripped = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(handle, "w") as f:
+        f.writelines(lines)
+    try:
+        Game(stripped, cache=False).visible_cards(0, 1)
+    except ValueError as e:
+        print "ValueError: ", e
+    finally:
+        os.remove(stripped)
@@ -0,0 +1,74 @@
+import hashlib
+import numpy as np
+
+"""
+Gameboard stored as a small integer array, one code per cell, with
+vectorized helpers over it. Players and cards are not part of the board;
+they are kept in GameState and the position -> cards layout.
+"""
+
+# Cell codes
+OPEN = 0
+WALL = 1
+BLOCKED = -1
+
+board_dtype = np.int8
+
+# Transcript layout characters that are not open space
+cell_codes = {"-": WALL, "b": BLOCKED}
+
+
+def parse_board(rows):
+    """
+    Board array from the layout rows of a CREATE_ENVIRONMENT line
+    :param rows: List of strings, one character per cell
+    :return: Array of shape (num_rows, num_cols) of cell codes
+    """
+    return np.array([[cell_codes.get(char, OPEN) for char in row] for row in rows],
+                    dtype=board_dtype)
+
+
+def free_cells(board):
+    """
+    Cells a player can stand on
+    :param board: Board array
+    :return: Boolean array of the board's shape
+    """
+    return board == OPEN
+
+
+def card_grid(shape, position_to_card):
+    """
+    Number of cards at each cell. Positions outside the board are ignored.
+    :param shape: Board shape
+    :param position_to_card: Dict of (row, col) -> list of cards
+    :return: Integer array of the given shape
+    """
+    grid = np.zeros(shape, dtype=np.int16)
+    positions = [(p, len(cards)) for p, cards in position_to_card.items()
+                 if cards and 0 <= p[0] < shape[0] and 0 <= p[1] < shape[1]]
+    if positions:
+        cells, counts = zip(*positions)
+        rows, cols = zip(*cells)
+        np.add.at(grid, (np.array(rows), np.array(cols)), counts)
+    return grid
+
+
+def card_occupancy(shape, position_to_card):
+    """
+    Cells holding at least one card
+    :param shape: Board shape
+    :param position_to_card: Dict of (row, col) -> list of cards
+    :return: Boolean array of the given shape
+    """
+    return card_grid(shape, position_to_card) > 0
+
+
+def board_hash(board):
+    """
+    Hash identifying a board layout, for caching results computed on it
+    :param board: Board array
+    :return: Hex digest string
+    """
+    board = np.ascontiguousarray(board, dtype=board_dtype)
+    return hashlib.sha1(str(board.shape) + board.tobytes()).hexdigest()
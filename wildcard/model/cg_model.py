@@ -1,20 +1,15 @@
 import numpy as np
 import os
-import random
 
 from collections import Counter
+from wildcard.model.evaluation import evaluate_predictions
+from wildcard.model.featurize import DialogueHashingVectorizer
+from wildcard.model.featurize import DialogueNgramVectorizer
+from wildcard.model.featurize import featurize_batch
 from wildcard.util.data_utils import split_data
-from wildcard.util.model_utils import compute_ed
-from wildcard.util.model_utils import free_hand
-from wildcard.util.model_utils import free_hand_2
-from wildcard.util.parse_annotations import extract_card
 from wildcard.util.parse_annotations import parse_all
-from sklearn.feature_extraction import DictVectorizer
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression, LinearRegression
-from sklearn.metrics import accuracy_score, f1_score, recall_score, precision_recall_curve, roc_curve, \
-                            confusion_matrix
-from sklearn.pipeline import FeatureUnion
 from sklearn.svm import SVC
 from sklearn import tree
 
@@ -28,109 +23,134 @@ class CGModel(object):
     """
     Model that uses common ground to predict player actions
     """
-    def __init__(self):
-        self.classifier = LogisticRegression()
-        self.feature_union = FeatureUnion([("count", CountVectorizer()),
-                                           ("feat", DictVectorizer())])
+    # Configuration of the n-gram features, part of their feature store key
+    ngram_range = (1, 2)
+
+    def __init__(self, feature_store=None, classifier=None, n_features=None):
+        """
+        :param feature_store: FeatureStore in which to keep the n-gram
+                              features of training and test data (default: none)
+        :param classifier: Classifier to train (default: LogisticRegression())
+        :param n_features: Hash n-grams into this many columns with
+                           DialogueHashingVectorizer instead of learning a
+                           vocabulary (default: learn a vocabulary)
+        """
+        self.classifier = classifier if classifier is not None else LogisticRegression()
+        self.feature_store = feature_store
+        self.n_features = n_features
 
 
     def _featurize(self, data):
         """
-        Featurize data
+        Featurize data with the vectorized featurizer
         :param data:
-        :return:
+        :return: Sparse matrix of dict features, dialogue texts, labels
         """
-        x, x_text, y = [], [], []
-        for k, d in enumerate(data):
-
-            ex = {}
-            hands = {"1": d["P1_HAND"], "2": d["P2_HAND"]}
-            coi = d["COI"]
-            window, ed, p1_ed, p2_ed, c_all = compute_ed(hands, coi)
-
-            ## HAND IMBALANCE FEATURE 
-            full_speaker_hand = None
-            full_addressee_hand = None
-            if d["SPEAKER"] == "P1":
-                full_speaker_hand = 1 if not free_hand_2(hands["1"])  else 0
-                full_addressee_hand = 1 if not free_hand_2(hands["2"]) else 0 
-            else:
-                full_speaker_hand = 1 if not free_hand_2(hands["2"]) else 0
-                full_addressee_hand = 1 if not free_hand_2(hands["1"]) else 0
-
-            #ex["HAND_IMBALANCE"] = 1 if (full_speaker_hand and not full_addressee_hand) else 0
-
-            ## SPEAKER FULL HAND FEATURE
-            # smart free hand feature
-            '''
-            # More fine-grained feature for card mentioned in strategy
-            '''
-            all_needed = d["P1_NEED"] + d["P2_NEED"]
-            all_needed = [extract_card(n) for n in all_needed]
-
-            mentioned = False
-            for c in all_needed:
-                if c == d["COI"]:
-                    mentioned = True
-                # Wild card suit
-                if c[0] == "X":
-                    if c[1] == d["COI"][-1]:
-                        mentioned = True
-
-            # if d["SPEAKER"] == "P1":
-            #     # Indicator function that addressee edit smaller than speaker
-            #     # if p2_ed < p1_ed:
-            #     #     ex["ADDRESSEE_EDIT"] = 1.
-            #     if c_all[0]:
-            #         ex["A_SHOULD_ACT"] = 1.
-            # else:
-            #     # if p1_ed < p2_ed:
-            #     #     ex["ADDRESSEE_EDIT"] = 1.
-            #     if c_all[1]:
-            #         ex["A_SHOULD_ACT"] = 1.
-            ex["EDIT"] = ed
-            label = d["POINTER"]
-
-            x_text.append(d["DIALOGUE"])
-            x.append(ex)
-            y.append(label)
-
-        return x, x_text, y
-
-    def train(self, data):
-        """
-        Train model
-        :return:
+        batch = featurize_batch(data)
+        # Other columns available from the batch: P1_EDIT, P2_EDIT, P1_ALL, P2_ALL,
+        # ADDRESSEE_EDIT, MENTIONED_STRATEGY, SPECIFIC_STRATEGY
+        x = batch.matrix(["EDIT"])
+        return x, batch.dialogues, batch.labels.tolist()
+
+    def _feature_config(self):
+        if self.n_features is not None:
+            return {"vectorizer": "DialogueHashingVectorizer", "ngram_range": list(self.ngram_range),
+                    "n_features": self.n_features}
+        return {"vectorizer": "DialogueNgramVectorizer", "ngram_range": list(self.ngram_range)}
+
+    def _new_vectorizer(self):
+        if self.n_features is not None:
+            return DialogueHashingVectorizer(n_features=self.n_features, ngram_range=self.ngram_range)
+        return DialogueNgramVectorizer(ngram_range=self.ngram_range)
+
+    def _feature_names(self):
+        if self.n_features is not None:
+            return []
+        return self.count_vectorizer.get_feature_names()
+
+    def _fit_counts(self, data):
+        """
+        Fit the n-gram vectorizer on data
+        :return: (count matrix, feature names, labels)
         """
         x, x_text, y = self._featurize(data)
+        self.count_vectorizer = self._new_vectorizer()
+        count_vec_transform = self.count_vectorizer.fit_transform(x_text)
+        return count_vec_transform, self._feature_names(), np.array(y)
+
+    def train(self, data, keep_features=False):
+        """
+        Train model. With a feature store, the fitted vocabulary and count
+        matrix of data are loaded from it when present.
+        :param keep_features: Keep the training count matrix on the model
+                              for refit(); not needed with a feature store,
+                              which refit() reloads it from
+        :return:
+        """
+        if self.feature_store is None:
+            count_vec_transform, _, y = self._fit_counts(data)
+        else:
+            self.train_key = self.feature_store.key(data, self._feature_config())
+            count_vec_transform, feature_names, y, _ = \
+                self.feature_store.get(data, self._feature_config(), self._fit_counts)
+            self.count_vectorizer = self._new_vectorizer()
+            if self.n_features is None:
+                self.count_vectorizer.vocabulary_ = dict((name, i) for i, name in enumerate(feature_names))
+
         # Positive prior for class distribution
         self.positive_prior = sum([1. for _ in y if _ == 1.]) / len(y)
 
-        self.feature_vectorizer = DictVectorizer()
-        self.count_vectorizer = CountVectorizer(ngram_range=(1,2))
+        self.train_x, self.train_y = (count_vec_transform, y) if keep_features else (None, None)
+        self.classifier.fit(count_vec_transform, y)
 
-        # Feature vectors converted to matrix  (num_samples, num_features)
-        #feature_vec_transform = self.feature_vectorizer.fit_transform(x)
-        count_vec_transform = self.count_vectorizer.fit_transform(x_text)
-
-        self.classifier.fit(count_vec_transform, np.array(y))
-        #self.classifier.fit(feature_vec_transform, np.array(y))
+    def refit(self, **params):
+        """
+        Refit the classifier on the training features with new
+        hyperparameters, e.g. refit(C=0.1), starting from the current
+        coefficients. Warm starting only takes effect with solvers that
+        support it ("lbfgs", "newton-cg", "sag", "saga"); liblinear refits
+        from scratch.
+        :param params: Classifier parameters to set
+        :return:
+        """
+        x, y = self.train_x, self.train_y
+        if x is None:
+            if self.feature_store is None:
+                raise ValueError("refit() needs train(data, keep_features=True) or a feature store")
+            x, _, y = self.feature_store.load(self.train_key)
+        self.classifier.set_params(warm_start=True, **params)
+        self.classifier.fit(x, y)
+
+    def _transform_counts(self, x_text, data):
+        """
+        N-gram counts of data under the fitted vocabulary, through the
+        feature store when there is one
+        """
+        if self.feature_store is None:
+            return self.count_vectorizer.transform(x_text)
+        config = dict(self._feature_config(), train_key=self.train_key)
+        x, _, _, _ = self.feature_store.get(
+            data, config, lambda _: (self.count_vectorizer.transform(x_text),
+                                     self._feature_names(),
+                                     np.array([d["POINTER"] for d in data])))
+        return x
 
 
-    def predict(self, x, x_text):
+    def predict(self, x, x_text, data=None):
         """
         Provide features for a given group as a dict
         :param x: Data instance
         :param x_test: Test of data instance
+        :param data: Examples x and x_text come from, to look their n-gram
+                     counts up in the feature store
         :return:
         """
-        # Transform features to appropriate format
-        #features_transformed = self.feature_vectorizer.transform(x)
-        count_vec_transformed = self.count_vectorizer.transform(x_text)
+        if data is None:
+            count_vec_transformed = self.count_vectorizer.transform(x_text)
+        else:
+            count_vec_transformed = self._transform_counts(x_text, data)
 
         y_scores = None
-        #y_scores = self.classifier.predict_proba(features_transformed)
-        #y_scores = [y[1] for y in y_scores]
 
         # Scores using unigram features
         y_scores_uni = None
@@ -140,45 +160,32 @@ class CGModel(object):
         return self.classifier.predict(count_vec_transformed), y_scores, y_scores_uni
 
 
-    def evaluate(self, test_data):
+    def evaluate(self, test_data, resamples=1000, seed=0):
         """
-        Test model
+        Test model against a random baseline (predicting 1 with the positive
+        prior of the training data) and a majority baseline (always 1)
         :param test_data:
-        :return:
+        :param resamples: Number of bootstrap resamples and random baseline
+                          draws behind the confidence intervals
+        :param seed: Seed of the resampling
+        :return: Dict of results, see evaluation.evaluate_predictions()
         """
         x, x_text, gold_labels = self._featurize(test_data)
-        predicted_labels, y_scores, y_scores_uni = self.predict(x, x_text)
-
-        baseline_labels = []
-        # baseline
-        for _ in range(len(gold_labels)):
-            if random.random() < self.positive_prior:
-                baseline_labels.append(1)
-            else:
-                baseline_labels.append(0)
-        baseline_accuracy = accuracy_score(gold_labels, baseline_labels)
-        baseline_recall = recall_score(gold_labels, baseline_labels)
-        baseline_f1 = f1_score(gold_labels, baseline_labels)
-
-        maj_labels = [1. for _ in range(len(baseline_labels))]
-        maj_accuracy = accuracy_score(gold_labels, maj_labels)
-        maj_recall = recall_score(gold_labels, maj_labels)
-        maj_f1 = f1_score(gold_labels, maj_labels)
-
-        accuracy = accuracy_score(gold_labels, predicted_labels)
-        recall = recall_score(gold_labels, predicted_labels)
-        f1 = f1_score(gold_labels, predicted_labels)
-
-        print "Accuracy: {0}, Recall: {1}, F1: {2}".format(accuracy,
-                                                    recall, f1)
-        print "Confusion Matrix: ", confusion_matrix(gold_labels, predicted_labels)
-
-        print "=" * 10
-        print "Random Baseline Accuracy: {0}, Recall: {1}, F1: {2}".format(baseline_accuracy,
-                                                    baseline_recall, baseline_f1)
-        print "Random Baseline Confusion Matrix: ", confusion_matrix(gold_labels, baseline_labels)
-
-        print "=" * 10
-        print "Maj Baseline Accuracy: {0}, Recall: {1}, F1: {2}".format(maj_accuracy,
-                                                    maj_recall, maj_f1)
-        print "Maj Baseline Confusion Matrix: ", confusion_matrix(gold_labels, maj_labels)
+        predicted_labels, y_scores, y_scores_uni = self.predict(x, x_text, test_data)
+
+        results = evaluate_predictions(gold_labels, predicted_labels, self.positive_prior,
+                                       majority_label=1, resamples=resamples, seed=seed)
+
+        for title, name in (("", "model"), ("Random Baseline ", "random_baseline"),
+                            ("Maj Baseline ", "majority_baseline")):
+            if name != "model":
+                print "=" * 10
+            metrics = results[name]["metrics"]
+            print "{0}Accuracy: {1}, Recall: {2}, F1: {3}".format(title, metrics["accuracy"],
+                                                            metrics["recall"], metrics["f1"])
+            if "ci" in results[name]:
+                print "{0}95% CI Accuracy: {1}, Recall: {2}, F1: {3}".format(
+                    title, results[name]["ci"]["accuracy"], results[name]["ci"]["recall"],
+                    results[name]["ci"]["f1"])
+            print "{0}Confusion Matrix: ".format(title), results[name]["confusion"]
+        return results
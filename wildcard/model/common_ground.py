@@ -0,0 +1,234 @@
+import multiprocessing
+import numpy as np
+import os
+import sys
+import traceback
+
+from glob import glob
+from wildcard.model.game import Game
+from wildcard.util.model_utils import Hand
+from wildcard.util.model_utils import card_mapping
+
+"""
+Common-ground state derived from game replays. For every chat message of
+a transcript, the replay gives both hands, both locations, the cards each
+player can see and the cards mentioned so far in the dialogue. Each
+transcript is written as one columnar shard (.npz) under an output
+directory; extract_corpus() skips transcripts whose shard already exists,
+so an interrupted run picks up where it stopped.
+
+The card recognizer also reports partial mentions: a suit alone ("XH" for
+"hearts") or a rank alone ("4X" for "four"). They name no card, so the
+mentioned column only holds the full cards named so far. The suits and
+ranks named alone so far are in mentioned_suits and mentioned_ranks, and
+partial_mentions counts the partial mentions of each message.
+"""
+
+# Bump when the columns change; shards of other versions are not reused
+SHARD_VERSION = 2
+SHARD_SUFFIX = ".v%d.npz" % SHARD_VERSION
+
+# Bit of each suit in the mentioned_suits column
+suit_bits = {"H": 1, "D": 2, "S": 4, "C": 8}
+
+# Columns of a shard, one row per chat message. Sets of cards are 52-bit
+# masks (see model_utils.Hand). Ranks are 13-bit masks, bit value - 1 as in
+# model_utils.card_mapping. A player without a sight radius in the
+# transcript sees nothing, and has radius -1.
+COLUMNS = [("move_index", np.int32), ("speaker", np.int8),
+           ("p1_x", np.int16), ("p1_y", np.int16), ("p2_x", np.int16), ("p2_y", np.int16),
+           ("p1_hand", np.int64), ("p2_hand", np.int64),
+           ("p1_visible", np.int64), ("p2_visible", np.int64),
+           ("mentioned", np.int64), ("mentioned_suits", np.int8), ("mentioned_ranks", np.int16),
+           ("partial_mentions", np.int16)]
+
+
+def split_mentions(cards):
+    """
+    Split cards named by the card recognizer into full cards and partial
+    mentions
+    :param cards: Card strings, e.g. ["4H", "XS", "QX"]
+    :return: (Hand of the full cards, suit bits of the suit-only
+             mentions, rank bits of the rank-only mentions, number of
+             partial mentions)
+    """
+    full, suits, ranks, partial = [], 0, 0, 0
+    for card in cards:
+        rank, suit = card[:-1], card[-1:]
+        if rank == "X" and suit in suit_bits:
+            suits |= suit_bits[suit]
+            partial += 1
+        elif suit == "X" and rank in card_mapping:
+            ranks |= 1 << (card_mapping[rank] - 1)
+            partial += 1
+        else:
+            full.append(card)
+    return Hand.from_cards(full, strict=False), suits, ranks, partial
+
+
+def extract_game(game):
+    """
+    Common-ground state at each chat message of a game. Hands, locations
+    and visible cards are those at the time of the message; mentioned
+    includes the cards named in the message itself, and so do
+    mentioned_suits and mentioned_ranks.
+    :param game: Game
+    :return: Dict of column name -> array, plus "message_offsets" and
+             "text" holding the messages, as in MoveLog
+    """
+    radius = dict((player, game.game_config.get("p%d_max_lineofsight" % player, -1))
+                  for player in (1, 2))
+
+    rows = []
+    messages = []
+    mentioned = Hand()
+    mentioned_suits, mentioned_ranks = 0, 0
+    state = game.initial_state()
+    for move in game.all_moves:
+        if move.move_type == "CHAT_MESSAGE_PREFIX":
+            cards, suits, ranks, partial = split_mentions(game.card_recognizer.cards(move.message))
+            mentioned = mentioned | cards
+            mentioned_suits |= suits
+            mentioned_ranks |= ranks
+            visible = [Hand.from_cards(game.visible_cards(state.idx, p), strict=False).mask
+                       if radius[p] >= 0 else 0 for p in (1, 2)]
+            rows.append((state.idx, move.player,
+                         state.p1_loc[0], state.p1_loc[1], state.p2_loc[0], state.p2_loc[1],
+                         Hand.from_cards(state.p1_cards, strict=False).mask,
+                         Hand.from_cards(state.p2_cards, strict=False).mask,
+                         visible[0], visible[1], mentioned.mask,
+                         mentioned_suits, mentioned_ranks, partial))
+            messages.append(move.message)
+        state = state.advance(move)
+
+    table = dict((name, np.array([row[i] for row in rows], dtype=dtype))
+                 for i, (name, dtype) in enumerate(COLUMNS))
+    table["p1_radius"] = np.array(radius[1], dtype=np.int16)
+    table["p2_radius"] = np.array(radius[2], dtype=np.int16)
+    table["message_offsets"] = np.concatenate([[0], np.cumsum([len(m) for m in messages])]).astype(np.int64)
+    table["text"] = np.array("".join(messages))
+    return table
+
+
+def shard_path(out_dir, corpus_dir, transcript):
+    """
+    Shard file of a transcript: its path relative to the corpus, with
+    directories joined by "__"
+    """
+    relative = os.path.relpath(transcript, corpus_dir)
+    return os.path.join(out_dir, relative.replace(os.sep, "__") + SHARD_SUFFIX)
+
+
+def write_shard(transcript, path):
+    """
+    Replay a transcript and write its shard. The shard is written under a
+    temporary name unique to the process and renamed into place, so a
+    shard that exists is complete and comes from a single run.
+    :param transcript: Path of the transcript
+    :param path: Shard file to write
+    :return: Number of rows written
+    """
+    table = extract_game(Game(transcript))
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **table)
+    os.rename(tmp_path, path)
+    return len(table["move_index"])
+
+
+def _write_shard(args):
+    """
+    Pool worker: write one shard, returning (transcript, rows, error).
+    Errors are passed back rather than raised so one bad transcript does
+    not stop the run.
+    """
+    transcript, path = args
+    try:
+        return transcript, write_shard(transcript, path), None
+    except Exception:
+        return transcript, 0, traceback.format_exc()
+
+
+def extract_corpus(corpus, out_dir, processes=1, chunksize=1, display_progress=True):
+    """
+    Write a shard for every transcript of a corpus that does not have one
+    yet. Workers write their shards themselves, so memory use does not
+    grow with the size of the corpus.
+    :param corpus: wildcard.util.cards.Corpus
+    :param out_dir: Directory for the shards, created if needed
+    :param processes: Number of worker processes; None uses every core
+    :param chunksize: Number of transcripts dispatched to a worker at a time
+    :param display_progress: Write a progress counter to stderr
+    :return: Dict of transcript -> error message, for transcripts that failed
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    transcripts = sorted(glob(os.path.join(corpus.dirname, "*/*.csv")))
+    todo = [(t, shard_path(out_dir, corpus.dirname, t)) for t in transcripts]
+    todo = [(t, path) for t, path in todo if not os.path.exists(path)]
+
+    pool = None
+    if processes == 1:
+        results = (_write_shard(job) for job in todo)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_write_shard, todo, chunksize)
+
+    errors = {}
+    try:
+        for done, (transcript, _, error) in enumerate(results, 1):
+            if error is not None:
+                errors[transcript] = error
+            if display_progress:
+                sys.stderr.write("\rtranscript %d/%d" % (done, len(todo)))
+                sys.stderr.flush()
+        if display_progress:
+            sys.stderr.write("\n")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return errors
+
+
+def load_shard(path):
+    """
+    Read a shard written by write_shard()
+    :param path: Shard file
+    :return: Dict of column name -> array
+    """
+    with np.load(path) as shard:
+        return dict((name, shard[name]) for name in shard.files)
+
+
+def load_table(out_dir):
+    """
+    Concatenate every shard in a directory into one table. The "transcript"
+    column gives the shard each row came from, as an index into the
+    returned list of shard names.
+    :param out_dir: Directory written by extract_corpus()
+    :return: (dict of column name -> array, list of shard names)
+    """
+    names = sorted(f for f in os.listdir(out_dir) if f.endswith(SHARD_SUFFIX))
+    columns = dict((name, []) for name, _ in COLUMNS)
+    transcript = []
+    for i, name in enumerate(names):
+        shard = load_shard(os.path.join(out_dir, name))
+        for column in columns:
+            columns[column].append(shard[column])
+        transcript.append(np.full(len(shard["move_index"]), i, dtype=np.int32))
+    table = dict((name, np.concatenate(columns[name]) if names else np.zeros(0, dtype=dtype))
+                 for name, dtype in COLUMNS)
+    table["transcript"] = np.concatenate(transcript) if names else np.zeros(0, dtype=np.int32)
+    return table, [name[:-len(SHARD_SUFFIX)] for name in names]
+
+
+def shard_messages(shard):
+    """
+    Chat messages of a shard, in row order
+    :param shard: Dict returned by load_shard()
+    :return: List of strings
+    """
+    text = str(shard["text"])
+    offsets = shard["message_offsets"]
+    return [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
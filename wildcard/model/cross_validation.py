@@ -0,0 +1,206 @@
+import itertools
+import multiprocessing
+import numpy as np
+
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score, mean_squared_error, precision_score, recall_score
+from wildcard.model.cg_model import CGModel
+from wildcard.model.linear_cg_model import CustomLinearRegression
+from wildcard.model.linear_cg_model import LinearCGModel
+
+"""
+Cross-validation and hyperparameter search for CGModel and LinearCGModel.
+Features are computed once, in the parent process, for all examples; the
+folds only select rows of them. The feature matrices are left in module
+globals before the worker pool is created, so forked workers read them
+without anything but (model, parameters, fold) being pickled per task.
+
+CGModel n-gram features use the vocabulary of all examples rather than of
+each training fold. Predictions are the same: a column that is all zero
+in the training rows gets a zero weight.
+"""
+
+# Metrics of every fold. Labels are predicted as score >= 0.5; mse is the
+# mean squared error of the scores (the Brier score for CGModel).
+METRICS = ["accuracy", "precision", "recall", "f1", "mse"]
+
+DEFAULT_GRIDS = {"CGModel": {"C": [0.1, 1.0, 10.0]},
+                 "LinearCGModel": {}}
+
+# Shared with forked workers, see cross_validate()
+_features = {}
+_folds = []
+
+
+def kfold_indices(n, k, seed=0):
+    """
+    Split range(n) into k folds of shuffled indices
+    :param n: Number of examples
+    :param k: Number of folds
+    :param seed: Seed of the shuffle
+    :return: List of k index arrays
+    """
+    if not 2 <= k <= n:
+        raise ValueError("Need 2 <= k <= %d folds, got %d" % (n, k))
+    order = np.random.RandomState(seed).permutation(n)
+    return [np.sort(fold) for fold in np.array_split(order, k)]
+
+
+def group_kfold_indices(groups, k, seed=0):
+    """
+    Split examples into k folds that never share a group, e.g. examples of
+    the same transcript. Groups are dealt, largest first, to the smallest
+    fold so far; ties between equal groups are broken by a seeded shuffle.
+    :param groups: Group of each example
+    :param k: Number of folds
+    :param seed: Seed of the tie-breaking shuffle
+    :return: List of k index arrays
+    """
+    names, inverse = np.unique(np.asarray(groups, dtype=object).astype(str), return_inverse=True)
+    if not 2 <= k <= len(names):
+        raise ValueError("Need 2 <= k <= %d folds (one per group), got %d" % (len(names), k))
+    sizes = np.bincount(inverse)
+    order = np.random.RandomState(seed).permutation(len(names))
+    order = order[np.argsort(-sizes[order], kind="mergesort")]
+    fold_of = np.empty(len(names), dtype=np.intp)
+    fold_sizes = np.zeros(k, dtype=np.intp)
+    for group in order:
+        fold = np.argmin(fold_sizes)
+        fold_of[group] = fold
+        fold_sizes[fold] += sizes[group]
+    example_fold = fold_of[inverse]
+    return [np.flatnonzero(example_fold == fold) for fold in range(k)]
+
+
+def expand_grid(grid):
+    """
+    Every combination of a hyperparameter grid
+    :param grid: Dict of parameter -> list of values
+    :return: List of parameter dicts, in sorted parameter order
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def model_features(name, data):
+    """
+    Features and labels of data for a model
+    :param name: "CGModel" or "LinearCGModel"
+    :param data: List of example dicts
+    :return: (sparse feature matrix, label array)
+    """
+    if name == "CGModel":
+        x, _, y = CGModel()._fit_counts(data)
+    elif name == "LinearCGModel":
+        x, y = LinearCGModel()._featurize(data)
+    else:
+        raise ValueError("Unknown model: %s" % name)
+    return x.tocsr(), np.asarray(y, dtype=np.float64)
+
+
+def _estimator(name, params):
+    if name == "CGModel":
+        return LogisticRegression(**params)
+    return CustomLinearRegression(**params)
+
+
+def _run_fold(task):
+    """
+    Pool worker: train and score one model on one fold
+    :param task: (model name, parameter dict, fold index)
+    :return: Result dict
+    """
+    name, params, fold = task
+    x, y = _features[name]
+    test = _folds[fold]
+    train = np.setdiff1d(np.arange(len(y)), test, assume_unique=True)
+    estimator = _estimator(name, params)
+    estimator.fit(x[train], y[train])
+    if name == "CGModel":
+        scores = estimator.predict_proba(x[test])[:, list(estimator.classes_).index(1.)]
+    else:
+        scores = estimator.predict(x[test])
+    predicted = (scores >= 0.5).astype(np.float64)
+    gold = y[test]
+    result = {"model": name, "params": params, "fold": fold,
+              "n_train": len(train), "n_test": len(test),
+              "accuracy": accuracy_score(gold, predicted),
+              "precision": precision_score(gold, predicted),
+              "recall": recall_score(gold, predicted),
+              "f1": f1_score(gold, predicted),
+              "mse": mean_squared_error(gold, scores)}
+    return result
+
+
+def cross_validate(data, k=5, grids=None, grouped=True, processes=1, seed=0):
+    """
+    Cross-validate models over hyperparameter grids
+    :param data: List of example dicts from parse_annotations
+    :param k: Number of folds
+    :param grids: Dict of model name -> hyperparameter grid, see
+                  expand_grid() (default: DEFAULT_GRIDS)
+    :param grouped: Keep all examples of a transcript in the same fold;
+                    otherwise split examples at random
+    :param processes: Number of worker processes; None uses every core
+    :param seed: Seed of the fold assignment
+    :return: List of result dicts, one per (model, parameters, fold)
+    """
+    global _folds
+    grids = DEFAULT_GRIDS if grids is None else grids
+    if grouped:
+        _folds = group_kfold_indices([ex["TRANSCRIPT"] for ex in data], k, seed)
+    else:
+        _folds = kfold_indices(len(data), k, seed)
+    _features.clear()
+    for name in sorted(grids):
+        _features[name] = model_features(name, data)
+
+    tasks = [(name, params, fold) for name in sorted(grids)
+             for params in expand_grid(grids[name]) for fold in range(k)]
+    if processes == 1:
+        return [_run_fold(task) for task in tasks]
+    # Created after the globals are set, for the workers to inherit them
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_run_fold, tasks)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def summarize(results):
+    """
+    Mean and standard deviation of the metrics of each configuration
+    :param results: Result dicts from cross_validate()
+    :return: List of dicts with model, params, folds and <metric>_mean,
+             <metric>_std for every metric, sorted by model then params
+    """
+    configs = {}
+    for result in results:
+        key = (result["model"], repr(sorted(result["params"].items())))
+        configs.setdefault(key, []).append(result)
+    summary = []
+    for (name, _), config_results in sorted(configs.items()):
+        row = {"model": name, "params": config_results[0]["params"], "folds": len(config_results)}
+        for metric in METRICS:
+            values = np.array([r[metric] for r in config_results])
+            row[metric + "_mean"] = values.mean()
+            row[metric + "_std"] = values.std()
+        summary.append(row)
+    return summary
+
+
+def format_table(summary):
+    """
+    Text table of a summary
+    :param summary: Rows from summarize()
+    :return: String
+    """
+    header = ["model", "params", "folds"] + METRICS
+    rows = [header]
+    for row in summary:
+        params = ", ".join("%s=%s" % item for item in sorted(row["params"].items())) or "-"
+        rows.append([row["model"], params, str(row["folds"])] +
+                    ["%.3f +/- %.3f" % (row[m + "_mean"], row[m + "_std"]) for m in METRICS])
+    widths = [max(len(r[i]) for r in rows) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(w) for cell, w in zip(r, widths)).rstrip() for r in rows)
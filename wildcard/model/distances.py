@@ -0,0 +1,178 @@
+import numpy as np
+
+from collections import OrderedDict
+from wildcard.model.board import board_hash
+from wildcard.model.board import free_cells
+
+"""
+Shortest path distances between cells of a gameboard. Players move one
+cell up, down, left or right at a time and only through open cells.
+Distances from a source are computed by breadth-first search on first
+use and kept in an LRU cache; all_pairs() fills in the whole matrix.
+Engines are shared between games with the same board layout.
+"""
+
+# Distance stored for cells that cannot be reached
+UNREACHABLE = np.iinfo(np.uint16).max
+
+# Number of boards whose engines are kept by engine_for()
+max_engines = 64
+_engines = OrderedDict()
+
+
+def engine_for(board):
+    """
+    Distance engine for a board, shared by every board with the same layout
+    :param board: Board array (see board.py)
+    :return: DistanceEngine
+    """
+    key = board_hash(board)
+    engine = _engines.pop(key, None)
+    if engine is None:
+        engine = DistanceEngine(board)
+    _engines[key] = engine
+    while len(_engines) > max_engines:
+        _engines.popitem(last=False)
+    return engine
+
+
+def card_suit(card):
+    """
+    Suit letter of a card string, e.g. "H" for "10H"
+    """
+    return card[-1]
+
+
+class DistanceEngine(object):
+    """
+    Distances between the cells of one board, as uint16 arrays indexed by
+    flat cell index (row * num_cols + col), with UNREACHABLE for cells
+    that cannot be reached
+    """
+    def __init__(self, board, cache_size=256):
+        """
+        :param board: Board array (see board.py)
+        :param cache_size: Number of sources whose distances are kept
+        """
+        self.board = np.array(board)
+        self.shape = self.board.shape
+        self.free = free_cells(self.board)
+        self.cache_size = cache_size
+        self._sources = OrderedDict()
+        self._matrix = None
+
+    def cell_index(self, pos):
+        """
+        Flat index of a (row, col) position
+        """
+        return pos[0] * self.shape[1] + pos[1]
+
+    def _bfs(self, pos):
+        """
+        Breadth-first search from pos, one frontier per step
+        """
+        dist = np.full(self.shape, UNREACHABLE, dtype=np.uint16)
+        frontier = np.zeros(self.shape, dtype=bool)
+        frontier[pos[0], pos[1]] = True
+        seen = frontier.copy()
+        d = 0
+        while frontier.any():
+            dist[frontier] = d
+            reached = np.zeros(self.shape, dtype=bool)
+            reached[1:] |= frontier[:-1]
+            reached[:-1] |= frontier[1:]
+            reached[:, 1:] |= frontier[:, :-1]
+            reached[:, :-1] |= frontier[:, 1:]
+            frontier = reached & self.free & ~seen
+            seen |= frontier
+            d += 1
+        return dist.ravel()
+
+    def distances_from(self, pos):
+        """
+        Distance from pos to every cell. The source itself need not be open.
+        :param pos: (row, col) position
+        :return: uint16 array of length num_rows * num_cols
+        """
+        if self._matrix is not None:
+            return self._matrix[self.cell_index(pos)]
+        key = (pos[0], pos[1])
+        dist = self._sources.pop(key, None)
+        if dist is None:
+            dist = self._bfs(key)
+        self._sources[key] = dist
+        while len(self._sources) > self.cache_size:
+            self._sources.popitem(last=False)
+        return dist
+
+    def all_pairs(self):
+        """
+        Distance between every pair of cells, computed once per engine
+        :return: uint16 array of shape (num_cells, num_cells)
+        """
+        if self._matrix is None:
+            cells = self.shape[0] * self.shape[1]
+            matrix = np.empty((cells, cells), dtype=np.uint16)
+            for i in range(cells):
+                matrix[i] = self.distances_from(divmod(i, self.shape[1]))
+            self._matrix = matrix
+            self._sources.clear()
+        return self._matrix
+
+    def distance(self, a, b):
+        """
+        Length of a shortest path between two positions
+        :param a: (row, col) position
+        :param b: (row, col) position
+        :return: Number of moves, or UNREACHABLE
+        """
+        return int(self.distances_from(a)[self.cell_index(b)])
+
+    def card_distances(self, pos, position_to_card):
+        """
+        Distance from pos to every card on the board
+        :param pos: (row, col) position
+        :param position_to_card: Dict of (row, col) -> list of cards
+        :return: Dict of card -> distance (UNREACHABLE if it cannot be reached)
+        """
+        dist = self.distances_from(pos)
+        return dict((card, int(dist[self.cell_index(p)]))
+                    for p, cards in position_to_card.items() for card in cards)
+
+    def nearest_card(self, pos, position_to_card, suit=None):
+        """
+        Closest card to pos, optionally of one suit. Ties go to the
+        smallest position, then to the first card there.
+        :param pos: (row, col) position
+        :param position_to_card: Dict of (row, col) -> list of cards
+        :param suit: Suit letter ("H", "D", "S" or "C"), or None for any card
+        :return: (card, position, distance), or None if no such card can be reached
+        """
+        dist = self.distances_from(pos)
+        best = None
+        for p in sorted(position_to_card):
+            d = dist[self.cell_index(p)]
+            if d == UNREACHABLE or (best is not None and d >= best[2]):
+                continue
+            for card in position_to_card[p]:
+                if suit is None or card_suit(card) == suit:
+                    best = (card, p, int(d))
+                    break
+        return best
+
+    def state_card_distances(self, state):
+        """
+        Distance from each player to every card on the board in a game state
+        :param state: GameState
+        :return: (p1 distances, p2 distances), dicts of card -> distance
+        """
+        return (self.card_distances(state.p1_loc, state.position_to_card),
+                self.card_distances(state.p2_loc, state.position_to_card))
+
+    def player_distance(self, state):
+        """
+        Distance between the two players in a game state
+        :param state: GameState
+        :return: Number of moves, or UNREACHABLE
+        """
+        return self.distance(state.p1_loc, state.p2_loc)
@@ -0,0 +1,145 @@
+import numpy as np
+
+"""
+Evaluation of binary predictions against gold labels. Every metric is
+derived from a 2x2 confusion matrix (rows gold, columns predicted, as in
+sklearn.metrics.confusion_matrix), and many resamples are counted at once
+as a stack of matrices, so random baselines and bootstrap confidence
+intervals over thousands of resamples need no Python loop per resample.
+"""
+
+METRICS = ["accuracy", "precision", "recall", "f1"]
+
+# Resamples are counted this many at a time, to bound memory
+_chunk_size = 256
+
+
+def confusion_counts(gold, predicted):
+    """
+    Confusion matrices of binary labels
+    :param gold: Array of 0/1 gold labels, shape (..., n)
+    :param predicted: Array of 0/1 predicted labels, broadcastable to gold
+    :return: Integer array of shape (..., 2, 2)
+    """
+    gold = np.asarray(gold) == 1
+    predicted = np.asarray(predicted) == 1
+    gold, predicted = np.broadcast_arrays(gold, predicted)
+    tp = np.sum(gold & predicted, axis=-1)
+    fn = np.sum(gold & ~predicted, axis=-1)
+    fp = np.sum(~gold & predicted, axis=-1)
+    tn = gold.shape[-1] - tp - fn - fp
+    return np.stack([np.stack([tn, fp], axis=-1), np.stack([fn, tp], axis=-1)], axis=-2)
+
+
+def _ratio(num, den):
+    # 0 where undefined, as sklearn does
+    num = np.asarray(num, dtype=np.float64)
+    den = np.asarray(den, dtype=np.float64)
+    return np.where(den > 0, num / np.where(den > 0, den, 1.), 0.)
+
+
+def confusion_metrics(confusion):
+    """
+    Metrics of confusion matrices
+    :param confusion: Array of shape (..., 2, 2) from confusion_counts()
+    :return: Dict of metric name -> array of shape (...)
+    """
+    tn, fp = confusion[..., 0, 0], confusion[..., 0, 1]
+    fn, tp = confusion[..., 1, 0], confusion[..., 1, 1]
+    precision = _ratio(tp, tp + fp)
+    recall = _ratio(tp, tp + fn)
+    return {"accuracy": _ratio(tp + tn, tp + tn + fp + fn),
+            "precision": precision,
+            "recall": recall,
+            "f1": _ratio(2 * precision * recall, precision + recall)}
+
+
+def _interval(values, confidence):
+    tail = 50. * (1. - confidence)
+    lo, hi = np.percentile(values, [tail, 100. - tail])
+    return float(lo), float(hi)
+
+
+def _summarize(confusions, confidence):
+    """
+    Mean metrics of a stack of confusion matrices, with percentile intervals
+    """
+    metrics = confusion_metrics(confusions)
+    return {"metrics": dict((m, float(metrics[m].mean())) for m in METRICS),
+            "confusion": confusions.mean(axis=0),
+            "ci": dict((m, _interval(metrics[m], confidence)) for m in METRICS)}
+
+
+def _evaluation(confusion):
+    metrics = confusion_metrics(confusion)
+    return {"metrics": dict((m, float(metrics[m])) for m in METRICS), "confusion": confusion}
+
+
+def bootstrap_confusions(gold, predicted, resamples, random_state):
+    """
+    Confusion matrices of bootstrap resamples of the examples
+    :param gold: Array of 0/1 gold labels
+    :param predicted: Array of 0/1 predicted labels
+    :param resamples: Number of resamples
+    :param random_state: numpy RandomState
+    :return: Integer array of shape (resamples, 2, 2)
+    """
+    # Each example is one of the four cells; a resample is a bincount of cells
+    cells = 2 * (np.asarray(gold) == 1) + (np.asarray(predicted) == 1)
+    n = len(cells)
+    confusions = []
+    for start in range(0, resamples, _chunk_size):
+        size = min(_chunk_size, resamples - start)
+        sampled = cells[random_state.randint(0, n, size=(size, n))]
+        offsets = 4 * np.arange(size)[:, None]
+        counts = np.bincount((sampled + offsets).ravel(), minlength=4 * size)
+        confusions.append(counts.reshape(size, 2, 2))
+    return np.concatenate(confusions)
+
+
+def random_confusions(gold, positive_prior, resamples, random_state):
+    """
+    Confusion matrices of random baselines predicting 1 with probability
+    positive_prior
+    :return: Integer array of shape (resamples, 2, 2)
+    """
+    gold = np.asarray(gold)
+    confusions = []
+    for start in range(0, resamples, _chunk_size):
+        size = min(_chunk_size, resamples - start)
+        predicted = random_state.random_sample((size, len(gold))) < positive_prior
+        confusions.append(confusion_counts(gold, predicted))
+    return np.concatenate(confusions)
+
+
+def evaluate_predictions(gold, predicted, positive_prior, majority_label=1, resamples=1000,
+                         confidence=0.95, seed=0):
+    """
+    Evaluate predictions against gold labels, together with a random and a
+    majority baseline
+    :param gold: 0/1 gold labels
+    :param predicted: 0/1 predicted labels
+    :param positive_prior: Probability with which the random baseline predicts 1
+    :param majority_label: Label predicted by the majority baseline
+    :param resamples: Number of bootstrap resamples for the model's
+                      confidence intervals, and of random baseline draws
+    :param confidence: Coverage of the confidence intervals
+    :param seed: Seed of the resampling
+    :return: Dict with "model", "random_baseline" and "majority_baseline",
+             each a dict with "metrics" (metric name -> value) and
+             "confusion" (2x2 array; the mean over draws for the random
+             baseline). "model" and "random_baseline" also have "ci"
+             (metric name -> (low, high)).
+    """
+    gold = np.asarray(gold)
+    predicted = np.asarray(predicted)
+    random_state = np.random.RandomState(seed)
+
+    model = _evaluation(confusion_counts(gold, predicted))
+    bootstrap = confusion_metrics(bootstrap_confusions(gold, predicted, resamples, random_state))
+    model["ci"] = dict((m, _interval(bootstrap[m], confidence)) for m in METRICS)
+
+    return {"model": model,
+            "random_baseline": _summarize(random_confusions(gold, positive_prior, resamples, random_state),
+                                          confidence),
+            "majority_baseline": _evaluation(confusion_counts(gold, majority_label))}
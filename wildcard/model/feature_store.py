@@ -0,0 +1,125 @@
+import hashlib
+import json
+import numpy as np
+import os
+import scipy.sparse as sp
+
+"""
+On-disk store of fitted n-gram features. A feature matrix is saved with
+the names of its columns and the labels of its rows, under a key hashing
+the examples it was computed from and the featurizer configuration, so
+training runs that only change the classifier reuse identical features.
+Matrices are saved as their CSR arrays with np.savez (scipy.sparse.save_npz
+needs scipy 0.19).
+"""
+
+# Bump when featurization changes, to invalidate stored features
+FEATURE_STORE_VERSION = 1
+
+
+def data_hash(data):
+    """
+    Hash of annotated examples, including their dialogue contexts. Each
+    dialogue buffer is hashed once however many examples share it.
+    :param data: List of example dicts from parse_annotations
+    :return: Hex digest string
+    """
+    digest = hashlib.sha1()
+    buffers = {}
+    for ex in data:
+        digest.update(repr(sorted((k, v) for k, v in ex.items()
+                                  if k not in ("DIALOGUE", "DIALOGUE_CONTEXT"))))
+        dialogue = ex.get("DIALOGUE_CONTEXT", ex.get("DIALOGUE"))
+        if dialogue is None:
+            continue
+        if isinstance(dialogue, basestring):
+            digest.update(hashlib.sha1(dialogue).hexdigest())
+            continue
+        buffer_digest = buffers.get(id(dialogue.buffer))
+        if buffer_digest is None:
+            buffer_digest = hashlib.sha1("\0".join(dialogue.buffer.turns)).hexdigest()
+            buffers[id(dialogue.buffer)] = buffer_digest
+        digest.update("%s:%d:%d" % (buffer_digest, dialogue.start, dialogue.end))
+    return digest.hexdigest()
+
+
+def config_hash(config):
+    """
+    Hash of a featurizer configuration
+    :param config: JSON-serializable dict
+    :return: Hex digest string
+    """
+    return hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()
+
+
+class FeatureStore(object):
+    """
+    Directory of stored feature matrices, one .npz file per key
+    """
+    def __init__(self, store_dir):
+        """
+        :param store_dir: Directory of the store, created on first save
+        """
+        self.store_dir = store_dir
+
+    def key(self, data, config):
+        """
+        Key of the features of data under a featurizer configuration
+        :param data: List of example dicts
+        :param config: JSON-serializable dict describing the featurizer
+        :return: Key string
+        """
+        return "%d-%s-%s" % (FEATURE_STORE_VERSION, config_hash(config)[:16], data_hash(data))
+
+    def path(self, key):
+        return os.path.join(self.store_dir, key + ".npz")
+
+    def load(self, key):
+        """
+        Stored features, or None if there are none under key
+        :param key: Key from key()
+        :return: (CSR matrix, list of feature names, label array)
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            x = sp.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            return x, f["feature_names"].tolist(), f["labels"]
+
+    def save(self, key, x, feature_names, labels):
+        """
+        Store features under key. The file is written under a temporary
+        name and renamed, so concurrent runs never see a partial file.
+        :param key: Key from key()
+        :param x: Sparse matrix of shape (num_examples, len(feature_names))
+        :param feature_names: Names of the columns of x
+        :param labels: Labels of the rows of x
+        :return:
+        """
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+        x = sp.csr_matrix(x)
+        path = self.path(key)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.savez(f, data=x.data, indices=x.indices, indptr=x.indptr, shape=np.array(x.shape),
+                     feature_names=np.array(feature_names, dtype=np.unicode_),
+                     labels=np.asarray(labels))
+        os.rename(tmp_path, path)
+
+    def get(self, data, config, compute):
+        """
+        Stored features of data, computing and storing them if needed
+        :param data: List of example dicts
+        :param config: JSON-serializable dict describing the featurizer
+        :param compute: Function of data returning (x, feature_names, labels)
+        :return: (x, feature_names, labels, whether they were stored already)
+        """
+        key = self.key(data, config)
+        stored = self.load(key)
+        if stored is not None:
+            return stored + (True,)
+        x, feature_names, labels = compute(data)
+        self.save(key, x, feature_names, labels)
+        return x, feature_names, labels, False
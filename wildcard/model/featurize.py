@@ -0,0 +1,429 @@
+import numpy as np
+import re
+import scipy.sparse as sp
+
+from sklearn.utils import murmurhash3_32
+from wildcard.util.cards import TOKENIZER
+from wildcard.util.model_utils import card_bits
+from wildcard.util.model_utils import card_mapping
+from wildcard.util.model_utils import compute_ed
+from wildcard.util.model_utils import suit_offsets
+from wildcard.util.model_utils import window_masks
+from wildcard.util.parse_annotations import DialogueBuffer
+from wildcard.util.parse_annotations import DialogueContext
+from wildcard.util.parse_annotations import extract_card
+
+"""
+Vectorized featurization of annotated utterances. Hands, cards of
+interest and needs are encoded as integer arrays for the whole dataset,
+and edit distances and strategy flags are computed with array operations,
+giving the same values as the per-example loops in CGModel and
+LinearCGModel.
+"""
+
+suits = sorted(suit_offsets, key=lambda s: suit_offsets[s])
+num_windows = 6
+
+# window_table[value, suit index, k] = card mask of window k
+window_table = np.zeros((14, len(suits), num_windows), dtype=np.int64)
+for (_val, _suit), _masks in window_masks.items():
+    window_table[_val, suits.index(_suit)] = _masks
+
+# Set bits of every byte value
+_byte_popcount = np.array([bin(b).count("1") for b in range(256)], dtype=np.int64)
+
+feature_names = ["ADDRESSEE_EDIT", "EDIT", "MENTIONED_STRATEGY", "SPECIFIC_STRATEGY"]
+
+
+def popcount(masks):
+    """
+    Number of set bits of each element of an int64 array
+    :param masks: Array of non-negative int64 masks
+    :return: Array of the same shape
+    """
+    masks = np.ascontiguousarray(masks, dtype=np.int64)
+    counts = _byte_popcount[masks.view(np.uint8)]
+    return counts.reshape(masks.shape + (8,)).sum(axis=-1)
+
+
+def _hand_mask(cards):
+    """
+    Card mask of a hand (empty strings dropped) and the distinct strings
+    that have no card bit
+    """
+    mask = 0
+    other = set()
+    for c in cards:
+        if c != "":
+            bit = card_bits.get(c)
+            if bit is None:
+                other.add(c)
+            else:
+                mask |= bit
+    return mask, other
+
+
+class FeatureBatch(object):
+    """
+    Features of a dataset held as one array per feature
+    """
+    def __init__(self, columns, dialogues, labels):
+        """
+        :param columns: Dict of feature or intermediate name -> array
+        :param dialogues: List of DialogueContext, or DIALOGUE strings of
+                          examples without one
+        :param labels: Array of labels
+        """
+        self.columns = columns
+        self.dialogues = dialogues
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def matrix(self, names=None, sparse=True):
+        """
+        Stack feature columns into a matrix of shape (num_samples, len(names))
+        :param names: Feature names, in column order (default: feature_names)
+        :param sparse: Return a CSR matrix rather than a dense array
+        :return:
+        """
+        if names is None:
+            names = feature_names
+        dense = np.column_stack([self.columns[n].astype(np.float64) for n in names]) \
+            if len(self) else np.zeros((0, len(names)))
+        if sparse:
+            return sp.csr_matrix(dense)
+        return dense
+
+
+def encode(data):
+    """
+    Encode the fields of annotated examples as integer arrays
+    :param data: List of example dicts from parse_annotations
+    :return: Dict of arrays
+    """
+    n = len(data)
+    p1_mask = np.zeros(n, dtype=np.int64)
+    p2_mask = np.zeros(n, dtype=np.int64)
+    p1_other = np.zeros(n, dtype=np.int64)
+    p2_other = np.zeros(n, dtype=np.int64)
+    all_other = np.zeros(n, dtype=np.int64)
+    coi_val = np.zeros(n, dtype=np.int64)
+    coi_suit = np.full(n, -1, dtype=np.int64)
+    speaker_p1 = np.zeros(n, dtype=bool)
+    has_need = np.zeros(n, dtype=bool)
+    specific = np.zeros(n, dtype=bool)
+
+    needs_cache = {}
+    for i, d in enumerate(data):
+        p1_mask[i], other1 = _hand_mask(d["P1_HAND"])
+        p2_mask[i], other2 = _hand_mask(d["P2_HAND"])
+        p1_other[i], p2_other[i], all_other[i] = len(other1), len(other2), len(other1 | other2)
+
+        coi = d["COI"]
+        suit = coi[-1]
+        if suit in suit_offsets:
+            coi_val[i] = card_mapping[coi.strip("SDCH")]
+            coi_suit[i] = suits.index(suit)
+
+        speaker_p1[i] = d["SPEAKER"] == "P1"
+        needs = d["P1_NEED"] + d["P2_NEED"]
+        has_need[i] = len(needs) > 0
+        for need in needs:
+            c = needs_cache.get(need)
+            if c is None:
+                c = needs_cache[need] = extract_card(need)
+            # Needed card is the COI, or a wild card of its suit
+            if c == coi or (c[0] == "X" and c[1] == coi[-1]):
+                specific[i] = True
+                break
+
+    return {"p1_mask": p1_mask, "p2_mask": p2_mask,
+            "p1_other": p1_other, "p2_other": p2_other, "all_other": all_other,
+            "coi_val": coi_val, "coi_suit": coi_suit, "speaker_p1": speaker_p1,
+            "has_need": has_need, "specific": specific}
+
+
+def edit_distances(enc):
+    """
+    Vectorized compute_ed() over encoded examples
+    :param enc: Output of encode()
+    :return: (ed, p1_ed, p2_ed, p1_all, p2_all) arrays
+    """
+    n = len(enc["p1_mask"])
+    rows = np.arange(n)
+    valid = enc["coi_suit"] >= 0
+    windows = window_table[enc["coi_val"], np.where(valid, enc["coi_suit"], 0)]
+    all_mask = enc["p1_mask"] | enc["p2_mask"]
+
+    # Cards without a bit are never in a window, so always overflow
+    eds = popcount(all_mask[:, None] ^ windows) + enc["all_other"][:, None]
+    # argmin keeps the first of equal windows, as compute_ed does
+    best = np.argmin(eds, axis=1) if n else np.zeros(0, dtype=np.int64)
+    ed = eds[rows, best]
+    w = windows[rows, best]
+
+    p1_inter = popcount(enc["p1_mask"] & w)
+    p1_diff = popcount(enc["p1_mask"] & ~w) + enc["p1_other"]
+    p2_inter = popcount(enc["p2_mask"] & w)
+    p2_diff = popcount(enc["p2_mask"] & ~w) + enc["p2_other"]
+    p1_ed = 2 * p1_diff + (3 - p1_diff - p1_inter)
+    p2_ed = 2 * p2_diff + (3 - p2_diff - p2_inter)
+    return ed, p1_ed, p2_ed, p1_diff == 0, p2_diff == 0
+
+
+def featurize_batch(data):
+    """
+    Featurize a whole dataset at once
+    :param data: List of example dicts from parse_annotations
+    :return: FeatureBatch
+    """
+    enc = encode(data)
+    ed, p1_ed, p2_ed, p1_all, p2_all = edit_distances(enc)
+
+    # Rare COIs whose suffix is not a suit go through compute_ed itself
+    for i in np.flatnonzero(enc["coi_suit"] < 0):
+        d = data[i]
+        _, ed[i], p1_ed[i], p2_ed[i], (p1_all[i], p2_all[i]) = \
+            compute_ed({"1": d["P1_HAND"], "2": d["P2_HAND"]}, d["COI"])
+
+    speaker_p1 = enc["speaker_p1"]
+    addressee_edit = np.where(speaker_p1, p2_ed < p1_ed, p1_ed < p2_ed)
+    columns = {"EDIT": ed, "P1_EDIT": p1_ed, "P2_EDIT": p2_ed,
+               "P1_ALL": p1_all, "P2_ALL": p2_all,
+               "ADDRESSEE_EDIT": addressee_edit,
+               "MENTIONED_STRATEGY": enc["has_need"],
+               "SPECIFIC_STRATEGY": enc["specific"]}
+    # Examples built by hand may only have the DIALOGUE text
+    dialogues = [d["DIALOGUE_CONTEXT"] if "DIALOGUE_CONTEXT" in d else d["DIALOGUE"] for d in data]
+    labels = np.array([d["POINTER"] for d in data])
+    return FeatureBatch(columns, dialogues, labels)
+
+
+class DialogueNgramVectorizer(object):
+    """
+    N-gram counts of dialogue contexts, giving the same matrix and
+    vocabulary as CountVectorizer(ngram_range=ngram_range) applied to
+    their text. Each turn of a DialogueBuffer is tokenized once for all
+    the examples sharing it. A context holding the whole dialogue so far
+    is counted from prefix counts of the buffer's n-grams (one
+    searchsorted per nonzero entry); a windowed context is counted from
+    the contiguous run of n-grams inside its window.
+    """
+    # CountVectorizer's default token pattern
+    token_re = re.compile(r"(?u)\b\w\w+\b")
+
+    def __init__(self, ngram_range=(1, 1), encoding="utf-8"):
+        """
+        :param ngram_range: (min_n, max_n), as for CountVectorizer
+        :param encoding: Encoding used to decode byte strings
+        """
+        self.ngram_range = ngram_range
+        self.encoding = encoding
+        self.vocabulary_ = None
+
+    def _tokenize(self, turn):
+        if isinstance(turn, bytes):
+            turn = turn.decode(self.encoding)
+        return self.token_re.findall(turn.lower())
+
+    def _occurrences(self, buffer):
+        """
+        Every n-gram occurrence in a buffer, ordered by last token
+        :return: (n-grams by local id, local id / first token / last token
+                  of each occurrence, index of the first token of each turn)
+        """
+        tokens, turn_start = [], []
+        for turn in buffer.turns:
+            turn_start.append(len(tokens))
+            tokens.extend(self._tokenize(turn))
+        turn_start.append(len(tokens))
+
+        min_n, max_n = self.ngram_range
+        local, ids, firsts, lasts = {}, [], [], []
+        for last in range(len(tokens)):
+            for n in range(min_n, min(max_n, last + 1) + 1):
+                first = last - n + 1
+                ids.append(local.setdefault(" ".join(tokens[first:last + 1]), len(local)))
+                firsts.append(first)
+                lasts.append(last)
+        grams = sorted(local, key=local.get)
+        return (grams, np.array(ids, dtype=np.int64), np.array(firsts, dtype=np.int64),
+                np.array(lasts, dtype=np.int64), np.array(turn_start, dtype=np.int64))
+
+    def _count_buffer(self, buffer, spans):
+        """
+        N-gram counts of the spans [start, end) of turns of one buffer
+        :param spans: List of (start, end) turn numbers
+        :return: (n-grams by local id, span index, local id and count arrays
+                  of the nonzero entries)
+        """
+        grams, ids, firsts, lasts, turn_start = self._occurrences(buffer)
+        num_tokens = turn_start[-1]
+        spans = np.array(spans, dtype=np.int64).reshape(-1, 2)
+        begin, stop = turn_start[spans[:, 0]], turn_start[spans[:, 1]]
+        rows, cols, counts = [], [], []
+
+        # Whole-dialogue spans: the n-grams first seen before the end of the
+        # span, each counted as its number of occurrences ending before it
+        whole = np.flatnonzero(begin == 0)
+        if len(whole) and len(ids):
+            keys = np.sort(ids * (num_tokens + 1) + lasts)
+            first_seen = np.full(len(grams), num_tokens, dtype=np.int64)
+            np.minimum.at(first_seen, ids, lasts)
+            by_first_seen = np.argsort(first_seen, kind="mergesort")
+            seen = np.searchsorted(first_seen[by_first_seen], stop[whole])
+            row = np.repeat(whole, seen)
+            offsets = np.arange(seen.sum()) - np.repeat(np.cumsum(seen) - seen, seen)
+            col = by_first_seen[offsets]
+            base = col * (num_tokens + 1)
+            count = np.searchsorted(keys, base + stop[row]) - np.searchsorted(keys, base)
+            rows.append(row)
+            cols.append(col)
+            counts.append(count)
+
+        # Windowed spans: occurrences ending inside the window that also
+        # start inside it, a contiguous run since occurrences are ordered
+        # by last token
+        for i in np.flatnonzero(begin > 0):
+            lo, hi = np.searchsorted(lasts, [begin[i], stop[i]])
+            window_ids = ids[lo:hi][firsts[lo:hi] >= begin[i]]
+            col, count = np.unique(window_ids, return_counts=True)
+            rows.append(np.full(len(col), i, dtype=np.int64))
+            cols.append(col)
+            counts.append(count)
+
+        if not rows:
+            return grams, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return grams, np.concatenate(rows), np.concatenate(cols), np.concatenate(counts)
+
+    def _count(self, dialogues, grow):
+        """
+        Count n-grams of dialogues, grouped by buffer
+        :param dialogues: List of DialogueContext or strings
+        :param grow: Add unseen n-grams to self.vocabulary_
+        :return: CSR matrix with columns in vocabulary insertion order
+        """
+        groups = {}
+        for i, dialogue in enumerate(dialogues):
+            if not isinstance(dialogue, DialogueContext):
+                buffer = DialogueBuffer()
+                buffer.append(dialogue)
+                dialogue = DialogueContext(buffer, 1)
+            group = groups.setdefault(id(dialogue.buffer), (dialogue.buffer, [], []))
+            group[1].append(i)
+            group[2].append((dialogue.start, dialogue.end))
+
+        rows, cols, vals = [], [], []
+        for buffer, indices, spans in groups.values():
+            grams, row, col, count = self._count_buffer(buffer, spans)
+            # Global column of each local n-gram that occurs, -1 if unknown
+            global_col = np.full(len(grams), -1, dtype=np.int64)
+            occurring = np.unique(col)
+            global_col[occurring] = self._columns([grams[c] for c in occurring], grow)
+            keep = global_col[col] >= 0
+            rows.append(np.array(indices, dtype=np.int64)[row[keep]])
+            cols.append(global_col[col[keep]])
+            vals.append(count[keep])
+
+        shape = (len(dialogues), self._num_columns())
+        if not rows:
+            return sp.csr_matrix(shape, dtype=np.int64)
+        return sp.csr_matrix((np.concatenate(vals).astype(np.int64),
+                              (np.concatenate(rows), np.concatenate(cols))), shape=shape)
+
+    def _columns(self, grams, grow):
+        """
+        Column of each n-gram in the vocabulary, -1 for unknown ones
+        :param grams: List of n-grams
+        :param grow: Add unknown n-grams to the vocabulary instead
+        :return: List of ints
+        """
+        columns = []
+        for gram in grams:
+            column = self.vocabulary_.get(gram)
+            if column is None and grow:
+                column = self.vocabulary_[gram] = len(self.vocabulary_)
+            columns.append(-1 if column is None else column)
+        return columns
+
+    def _num_columns(self):
+        return len(self.vocabulary_)
+
+    def fit_transform(self, dialogues):
+        """
+        Learn the vocabulary and count n-grams
+        :param dialogues: List of DialogueContext or strings
+        :return: CSR matrix of shape (len(dialogues), len(vocabulary_))
+        """
+        self.vocabulary_ = {}
+        x = self._count(dialogues, grow=True)
+        # Sort columns by n-gram, as CountVectorizer does
+        grams = sorted(self.vocabulary_)
+        x = x[:, [self.vocabulary_[gram] for gram in grams]]
+        x.sort_indices()
+        self.vocabulary_ = dict((gram, i) for i, gram in enumerate(grams))
+        return x
+
+    def fit(self, dialogues):
+        self.fit_transform(dialogues)
+        return self
+
+    def transform(self, dialogues):
+        """
+        Count n-grams of the fitted vocabulary
+        :param dialogues: List of DialogueContext or strings
+        :return: CSR matrix of shape (len(dialogues), len(vocabulary_))
+        """
+        x = self._count(dialogues, grow=False)
+        x.sort_indices()
+        return x
+
+    def get_feature_names(self):
+        return sorted(self.vocabulary_, key=self.vocabulary_.get)
+
+
+class DialogueHashingVectorizer(DialogueNgramVectorizer):
+    """
+    N-gram counts of dialogue contexts in a fixed number of columns: an
+    n-gram counts towards column murmurhash3_32(n-gram) % n_features.
+    Tokens come from the card-aware Tokenizer, lowercased. There is no
+    vocabulary, so transform() needs no fitting, gives the same result in
+    any process and uses memory independent of how much text it has seen.
+    Columns have no names, so do not call get_feature_names().
+    """
+    def __init__(self, n_features=2 ** 20, ngram_range=(1, 2), tokenizer=None):
+        """
+        :param n_features: Number of columns
+        :param ngram_range: (min_n, max_n)
+        :param tokenizer: Tokenizer to use (default: the shared cards.TOKENIZER)
+        """
+        super(DialogueHashingVectorizer, self).__init__(ngram_range)
+        self.n_features = n_features
+        self.tokenizer = tokenizer if tokenizer is not None else TOKENIZER
+
+    def _tokenize(self, turn):
+        return [token.lower() for token in self.tokenizer.tokenize(turn)]
+
+    def _columns(self, grams, grow):
+        return [murmurhash3_32(gram, positive=True) % self.n_features for gram in grams]
+
+    def _num_columns(self):
+        return self.n_features
+
+    def fit(self, dialogues):
+        return self
+
+    def fit_transform(self, dialogues):
+        return self.transform(dialogues)
+
+    def transform(self, dialogues):
+        """
+        Count n-grams into hashed columns
+        :param dialogues: List of DialogueContext or strings
+        :return: CSR matrix of shape (len(dialogues), n_features)
+        """
+        x = self._count(dialogues, grow=False)
+        x.sum_duplicates()
+        return x
@@ -1,48 +1,213 @@
-import copy
 import csv
 import json
 import numpy as np
 import os
 
 from collections import defaultdict
+from wildcard.model.board import parse_board
+from wildcard.model.distances import engine_for
+from wildcard.model.visibility import visibility_engine_for
+from wildcard.util.card_mentions import CardRecognizer
 from wildcard.util.cards import Tokenizer
+from wildcard.util.corpus_cache import cached_rows
 from wildcard.util.model_utils import card_expressions
-from wildcard.util.model_utils import mentions_cards
 
 """
 Stores an instance of a game corresponding to a transcript
 """
 
-class Move(object):
+# Move types with a position, and those of them that also have a card
+COORD_MOVE_TYPES = ("PLAYER_MOVE", "PLAYER_PICKUP_CARD", "PLAYER_DROP_CARD")
+CARD_MOVE_TYPES = ("PLAYER_PICKUP_CARD", "PLAYER_DROP_CARD")
+# Transcript rows that are neither moves nor game settings, and are dropped
+METADATA_ACTIONS = ("ORIGINAL_FILENAME", "COLLECTION_SITE", "TASK_COMPLETED",
+                    "PLAYER_1", "PLAYER_2", "PLAYER_1_TASK_ID", "PLAYER_2_TASK_ID", "GOAL_DESCRIPTION")
+# Every transcript action that is not a move of Game.all_moves
+SETUP_ACTIONS = ("CREATE_ENVIRONMENT", "P1_MAX_CARDS", "P2_MAX_CARDS", "P1_MAX_TURNS", "P2_MAX_TURNS",
+                 "PLAYER_INITIAL_LOCATION") + METADATA_ACTIONS
+
+
+def move_message(move_type, text):
     """
-    Stores a single move of the game
+    Message of a move, as Move.message gives it
+    :param move_type: Transcript action of the move
+    :param text: Contents of the transcript row (only used for chat messages)
+    :return: The chat text, "TASK_COMPLETE_CLICKED" for other moves
+             without a position, or None for moves with one
     """
-    def __init__(self, player, move_type, data, mentions_card):
-        if player == "Player 1":
-            self.player = 1
-        else:
-            self.player = 2
+    if move_type in COORD_MOVE_TYPES:
+        return None
+    elif move_type == "CHAT_MESSAGE_PREFIX":
+        return text
+    return "TASK_COMPLETE_CLICKED"
 
-        self.move_type = move_type
-        # NOTE: mentions_card field only relevant for message type moves
-        self.mentions_card = mentions_card
 
+class MoveLog(object):
+    """
+    The moves of a game stored column-wise: one array each for player,
+    move type code, x, y and card code (-1 where a move has no position or
+    card), plus message offsets into one shared text buffer. Indexing and
+    iterating give Move views onto rows.
+    """
+    def __init__(self):
+        # Code -> move type / card, and back
+        self.move_types = []
+        self.cards = []
+        self._type_codes = {}
+        self._card_codes = {}
+
+        self.player = np.zeros(0, dtype=np.int8)
+        self.type_code = np.zeros(0, dtype=np.int8)
+        self.x = np.zeros(0, dtype=np.int16)
+        self.y = np.zeros(0, dtype=np.int16)
+        self.card_code = np.zeros(0, dtype=np.int16)
+        self.mentions_card = np.zeros(0, dtype=bool)
+        # Message of row i is text[message_offsets[i]:message_offsets[i + 1]]
+        self.message_offsets = np.zeros(1, dtype=np.int64)
+        self.text = ""
+
+        # Rows added since the arrays were last built
+        self._pending = []
+
+    def _code(self, codes, values, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def add(self, player, move_type, data, mentions_card):
+        """
+        Add a move given as in a transcript line
+        :param player: "Player 1" or "Player 2"
+        :param move_type: Action, e.g. "PLAYER_MOVE"
+        :param data: Contents, e.g. "8,10" or "16,14:4H"
+        :param mentions_card: Whether a chat message mentions a card
+        :return:
+        """
+        x, y, card, message = -1, -1, -1, ""
         if move_type == "PLAYER_MOVE":
-            self.coords = [int(c) for c in data.split(",")]
-            self.card = None
-            self.message = None
-
-        elif move_type == "PLAYER_PICKUP_CARD" or move_type == "PLAYER_DROP_CARD":
+            x, y = [int(c) for c in data.split(",")]
+        elif move_type in CARD_MOVE_TYPES:
             x, rest = data.split(",")
             y, card = rest.split(":")
-            self.coords = [int(x), int(y)]
-            self.card = card
-            self.message = None
+            x, y = int(x), int(y)
+            card = self._code(self._card_codes, self.cards, card)
         elif move_type == "CHAT_MESSAGE_PREFIX":
-            self.coords, self.card = None, None
-            self.message = data
+            message = data
+        self._pending.append((1 if player == "Player 1" else 2,
+                              self._code(self._type_codes, self.move_types, move_type),
+                              x, y, card, mentions_card, message))
+
+    def append(self, move):
+        """
+        Add a copy of a Move, which may belong to another log
+        :param move: Move
+        :return:
+        """
+        if move.coords is not None:
+            data = "%d,%d" % tuple(move.coords)
+            if move.card is not None:
+                data += ":" + move.card
         else:
-            self.coords, self.card, self.message = None, None, "TASK_COMPLETE_CLICKED"
+            data = move.message
+        self.add("Player %d" % move.player, move.move_type, data, move.mentions_card)
+
+    def _flush(self):
+        """
+        Move pending rows into the arrays
+        """
+        if not self._pending:
+            return
+        player, type_code, x, y, card, mentions, messages = zip(*self._pending)
+        self.player = np.concatenate([self.player, np.array(player, dtype=np.int8)])
+        self.type_code = np.concatenate([self.type_code, np.array(type_code, dtype=np.int8)])
+        self.x = np.concatenate([self.x, np.array(x, dtype=np.int16)])
+        self.y = np.concatenate([self.y, np.array(y, dtype=np.int16)])
+        self.card_code = np.concatenate([self.card_code, np.array(card, dtype=np.int16)])
+        self.mentions_card = np.concatenate([self.mentions_card, np.array(mentions, dtype=bool)])
+        lengths = np.array([len(m) for m in messages], dtype=np.int64)
+        self.message_offsets = np.concatenate([self.message_offsets,
+                                               self.message_offsets[-1] + np.cumsum(lengths)])
+        self.text += "".join(messages)
+        self._pending = []
+
+    def __len__(self):
+        return len(self.player) + len(self._pending)
+
+    def __getitem__(self, k):
+        self._flush()
+        if isinstance(k, slice):
+            return [Move.view(self, row) for row in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("move index out of range")
+        return Move.view(self, k)
+
+    def __iter__(self):
+        self._flush()
+        for row in range(len(self)):
+            yield Move.view(self, row)
+
+
+class Move(object):
+    """
+    Stores a single move of the game, as a view onto a row of a MoveLog
+    """
+    __slots__ = ("_log", "_row")
+
+    def __init__(self, player, move_type, data, mentions_card):
+        self._log = MoveLog()
+        self._log.add(player, move_type, data, mentions_card)
+        self._log._flush()
+        self._row = 0
+
+    @classmethod
+    def view(cls, log, row):
+        """
+        Move at a row of log, without copying it
+        :param log: MoveLog
+        :param row: Row index
+        :return: Move
+        """
+        move = cls.__new__(cls)
+        move._log = log
+        move._row = row
+        return move
+
+    @property
+    def player(self):
+        return int(self._log.player[self._row])
+
+    @property
+    def move_type(self):
+        return self._log.move_types[self._log.type_code[self._row]]
+
+    @property
+    def mentions_card(self):
+        # NOTE: mentions_card field only relevant for message type moves
+        return bool(self._log.mentions_card[self._row])
+
+    @property
+    def coords(self):
+        if self.move_type not in COORD_MOVE_TYPES:
+            return None
+        return [int(self._log.x[self._row]), int(self._log.y[self._row])]
+
+    @property
+    def card(self):
+        code = self._log.card_code[self._row]
+        return self._log.cards[code] if code >= 0 else None
+
+    @property
+    def message(self):
+        move_type = self.move_type
+        text = None
+        if move_type == "CHAT_MESSAGE_PREFIX":
+            offsets = self._log.message_offsets
+            text = self._log.text[offsets[self._row]:offsets[self._row + 1]]
+        return move_message(move_type, text)
 
     @property
     def _data_str(self):
@@ -63,7 +228,10 @@ class Move(object):
 
 class GameState(object):
     """
-    Stores game state information
+    Stores game state information. The hands and card layout passed in may
+    be shared with other states: a state copies a hand, the layout or a
+    card bucket the first time it modifies it, and never writes to the
+    originals.
     """
     def __init__(self, p1_loc, p2_loc, p1_cards, p2_cards, position_to_card, idx=0, gameboard=None):
         self.p1_loc = p1_loc
@@ -75,29 +243,307 @@ class GameState(object):
         self.idx = idx
         # Describes where walls/open space is, represented in array format
         self.gameboard = gameboard
+        # Containers this state made itself and may modify, by id
+        self._owned = {}
+
+    def _own(self, container):
+        """
+        container if this state made it, otherwise a copy that it now owns
+        """
+        if self._owned.get(id(container)) is not container:
+            if isinstance(container, dict):
+                container = defaultdict(list, container)
+            else:
+                container = list(container)
+            self._owned[id(container)] = container
+        return container
+
+    def writable_hand(self, player):
+        """
+        Hand of player, copied first if it is shared with another state
+        :param player: 1 or 2
+        :return: List of cards that may be modified in place
+        """
+        if player == 1:
+            self.p1_cards = self._own(self.p1_cards)
+            return self.p1_cards
+        self.p2_cards = self._own(self.p2_cards)
+        return self.p2_cards
+
+    def writable_bucket(self, coords):
+        """
+        Cards at coords, copied first (along with the layout holding them)
+        if they are shared with another state
+        :param coords: (x, y) position
+        :return: List of cards that may be modified in place
+        """
+        position = (coords[0], coords[1])
+        self.position_to_card = self._own(self.position_to_card)
+        bucket = self._own(self.position_to_card.get(position, []))
+        self.position_to_card[position] = bucket
+        return bucket
+
+    def advance(self, move):
+        """
+        Return the state after move without modifying this one. Only what
+        the move changes is new: a moved player's location, a changed hand,
+        and the card bucket at the pickup/drop position. The gameboard and
+        every other bucket are shared with this state.
+        :param move: Move to apply
+        :return: New GameState
+        """
+        state = GameState(self.p1_loc, self.p2_loc, self.p1_cards, self.p2_cards,
+                          self.position_to_card, idx=self.idx + 1, gameboard=self.gameboard)
+        if move.move_type == "PLAYER_MOVE":
+            if move.player == 1:
+                state.p1_loc = move.coords
+            elif move.player == 2:
+                state.p2_loc = move.coords
+        elif move.move_type == "PLAYER_PICKUP_CARD":
+            if move.player == 1:
+                state.p1_cards = self.p1_cards + [move.card]
+            elif move.player == 2:
+                state.p2_cards = self.p2_cards + [move.card]
+            bucket = list(self.position_to_card.get((move.coords[0], move.coords[1]), []))
+            bucket.remove(move.card)
+            state.position_to_card = _replace_bucket(self.position_to_card, move.coords, bucket)
+        elif move.move_type == "PLAYER_DROP_CARD":
+            try:
+                if move.player == 1:
+                    state.p1_cards = _without(self.p1_cards, move.card)
+                elif move.player == 2:
+                    state.p2_cards = _without(self.p2_cards, move.card)
+            except ValueError as e:
+                print e
+            bucket = self.position_to_card.get((move.coords[0], move.coords[1]), []) + [move.card]
+            state.position_to_card = _replace_bucket(self.position_to_card, move.coords, bucket)
+        return state
+
+    def undo_record(self, move):
+        """
+        What is needed to undo move once it has been applied to this state:
+        the mover's previous location for PLAYER_MOVE, the position of the
+        card in its bucket for PLAYER_PICKUP_CARD, and its position in the
+        dropping player's hand (None if it was not there) for PLAYER_DROP_CARD
+        :param move: Move about to be applied
+        :return:
+        """
+        if move.move_type == "PLAYER_MOVE":
+            return self.p1_loc if move.player == 1 else self.p2_loc
+        elif move.move_type == "PLAYER_PICKUP_CARD":
+            return self.position_to_card.get((move.coords[0], move.coords[1]), []).index(move.card)
+        elif move.move_type == "PLAYER_DROP_CARD":
+            cards = self.p1_cards if move.player == 1 else self.p2_cards
+            return cards.index(move.card) if move.card in cards else None
+        return None
+
+    def retreat(self, move, undo):
+        """
+        Inverse of advance(): return the state before move, given the state
+        after it. Like advance(), shares everything the move did not change.
+        :param move: Move that led to this state
+        :param undo: undo_record() of the state before move
+        :return: New GameState
+        """
+        state = GameState(self.p1_loc, self.p2_loc, self.p1_cards, self.p2_cards,
+                          self.position_to_card, idx=self.idx - 1, gameboard=self.gameboard)
+        if move.move_type == "PLAYER_MOVE":
+            if move.player == 1:
+                state.p1_loc = undo
+            elif move.player == 2:
+                state.p2_loc = undo
+        elif move.move_type == "PLAYER_PICKUP_CARD":
+            # The picked up card is the last one in the hand
+            if move.player == 1:
+                state.p1_cards = self.p1_cards[:-1]
+            elif move.player == 2:
+                state.p2_cards = self.p2_cards[:-1]
+            bucket = list(self.position_to_card[(move.coords[0], move.coords[1])])
+            bucket.insert(undo, move.card)
+            state.position_to_card = _replace_bucket(self.position_to_card, move.coords, bucket)
+        elif move.move_type == "PLAYER_DROP_CARD":
+            if undo is not None:
+                if move.player == 1:
+                    state.p1_cards = self.p1_cards[:undo] + [move.card] + self.p1_cards[undo:]
+                elif move.player == 2:
+                    state.p2_cards = self.p2_cards[:undo] + [move.card] + self.p2_cards[undo:]
+            # The dropped card is the last one in the bucket
+            bucket = self.position_to_card[(move.coords[0], move.coords[1])][:-1]
+            state.position_to_card = _replace_bucket(self.position_to_card, move.coords, bucket)
+        return state
+
+
+def _without(cards, card):
+    """
+    Copy of cards with the first occurrence of card removed
+    """
+    cards = list(cards)
+    cards.remove(card)
+    return cards
+
+
+def _replace_bucket(position_to_card, coords, bucket):
+    """
+    Shallow copy of position_to_card with the bucket at coords replaced.
+    The card lists of all other positions are shared, not copied.
+    """
+    replaced = defaultdict(list, position_to_card)
+    replaced[(coords[0], coords[1])] = bucket
+    return replaced
+
+
+class GameStateHistory(object):
+    """
+    The sequence of game states between two move numbers, as returned by
+    Game.game_state_evolve(). States are materialized on first access by
+    applying moves to the closest earlier state with GameState.advance(),
+    so walking the history in order costs one advance() per move.
+    """
+    def __init__(self, game, start, end):
+        """
+        :param game: Game to replay
+        :param start: Move number of the first state
+        :param end: Move number of the last state
+        """
+        self.game = game
+        self.start = start
+        self._states = [None] * (end - start + 1)
+        self._states[0] = game.step(num_moves=start)
+        # Highest index materialized so far
+        self._last = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("game state index out of range")
+        while self._last < k:
+            state = self._states[self._last]
+            self._states[self._last + 1] = state.advance(self.game.all_moves[state.idx])
+            self._last += 1
+        return self._states[k]
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+
+# Shared by all games, since building the automaton is the expensive part
+card_recognizer = CardRecognizer()
+
+
+class GameTimeline(object):
+    """
+    Random access to the state after any number of moves. A snapshot is
+    kept every interval moves, along with an undo record per move, so
+    state_at() replays at most interval / 2 moves, forward from the
+    snapshot before k or backward from the one after it. Snapshots share
+    unchanged structure (see GameState.advance), so they are cheap to keep.
+    """
+    def __init__(self, game, interval=64):
+        """
+        :param game: Game whose moves to replay
+        :param interval: Number of moves between snapshots
+        """
+        if interval < 1:
+            raise ValueError("interval must be positive, got %d" % interval)
+        self.game = game
+        self.interval = interval
+        self._snapshots = [game.initial_state()]
+        self._undo = []
+        # Furthest state replayed so far
+        self._last = self._snapshots[0]
+
+    def __len__(self):
+        """
+        Number of states, i.e. one more than the number of moves
+        """
+        return len(self.game.all_moves) + 1
+
+    def _extend(self, k):
+        """
+        Replay far enough to have the snapshot after move k, recording an
+        undo record for every move on the way
+        """
+        moves = self.game.all_moves
+        stop = min(len(moves), (k // self.interval + 1) * self.interval)
+        state = self._last
+        while state.idx < stop:
+            move = moves[state.idx]
+            self._undo.append(state.undo_record(move))
+            state = state.advance(move)
+            if state.idx % self.interval == 0:
+                self._snapshots.append(state)
+        self._last = state
+
+    def state_at(self, k):
+        """
+        State after the first k moves
+        :param k: Number of moves, 0 <= k <= len(game.all_moves)
+        :return: GameState; do not modify it, it shares structure with others
+        """
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("move number out of range")
+        self._extend(k)
+        moves = self.game.all_moves
+        base = k // self.interval
+        offset = k - base * self.interval
+        if offset > self.interval // 2 and base + 1 < len(self._snapshots):
+            state = self._snapshots[base + 1]
+            while state.idx > k:
+                move = moves[state.idx - 1]
+                state = state.retreat(move, self._undo[state.idx - 1])
+            return state
+        state = self._snapshots[base]
+        for move in moves[state.idx:k]:
+            state = state.advance(move)
+        return state
+
+    def __getitem__(self, k):
+        return self.state_at(k)
 
 
 class Game(object):
     """
     Stores all information related to a certain game
     """
-    def __init__(self, transcript):
-        # Stores gameboard start, as numpy array of strings
+    def __init__(self, transcript, cache=None):
+        """
+        :param transcript: Path of the transcript to load
+        :param cache: CorpusCache to read the transcript from; None looks for a
+                      compiled cache next to the corpus, False always reads the CSV
+        """
+        # Stores gameboard start, as an int8 array of codes from board.py.
+        # Player locations are in game_config, card positions in position_to_card
         self.start_gameboard = None
         # Stores various parameters about the current game
         self.game_config = {}
         # Some utilities for processing data
         self.card_expressions = card_expressions()
         self.tokenizer = Tokenizer()
+        self.card_recognizer = card_recognizer
 
         # Store all moves in game
-        self.all_moves = []
+        self.all_moves = MoveLog()
         self.transcript = transcript
-        self._process_transcript()
+        self._process_transcript(cache)
 
         # Store cards that each player has in hands
         # NOTE: The below is not updated as the game is stepped through...
         self.p1_cards, self.p2_cards = [], []
+        # Moves between snapshots of the timeline behind state_at()
+        self.checkpoint_interval = 64
+        self._timeline = None
+        self._distance_engine = None
+        # Player -> cards visible after each number of moves, see visible_cards()
+        self._visible_cards = {}
         # In case a transcript does not have this information
         if "p1_initial_location" in self.game_config:
             self.p1_loc = self.game_config["p1_initial_location"]
@@ -123,20 +569,8 @@ class Game(object):
                 start = i
                 break
 
-        # recreate board as a numpy array of ones and zeros
-        gameboard = []
-        for row in rows:
-            row_rep = []
-            for char in row:
-                if char == "-":
-                    row_rep.append(1)
-                elif char == "b":
-                    row_rep.append(-1)
-                else:
-                    row_rep.append(0)
-            gameboard.append(row_rep)
-        # Convert to numpy array
-        gameboard = np.array(gameboard, dtype=object)
+        # recreate board as an int8 array of wall/blocked/open codes
+        gameboard = parse_board(rows)
 
         # now get card positions from the rest of the entries
         position_to_card = defaultdict(list)
@@ -153,45 +587,156 @@ class Game(object):
 
         self.start_gameboard = gameboard
         self.position_to_card = position_to_card
+        # Layout replays start from; kept apart from position_to_card, which
+        # callers such as the GUI update as they go
+        self._start_layout = defaultdict(list)
+        for position, cards in position_to_card.items():
+            self._start_layout[position] = list(cards)
         self.card_to_position = card_to_position
 
-    def _process_transcript(self):
+    def _process_transcript(self, cache=None):
         """
         Processes a transcript and reads the gameboard in appropriately,
         as well as storing all moves made in game
+        :param cache: See Game.__init__
         :return:
         """
-        with open(self.transcript) as f:
-            file_reader = csv.reader(f)
-            for line in file_reader:
-                if line[2] == "CREATE_ENVIRONMENT":
-                    self._recreate_start_gameboard(line[3])
-                elif line[2] == "P1_MAX_CARDS":
-                    self.game_config["p1_max_cards"] = int(line[3])
-                elif line[2] == "P2_MAX_CARDS":
-                    self.game_config["p2_max_cards"] = int(line[3])
-                elif line[2] == "P1_MAX_TURNS":
-                    self.game_config["p1_max_turns"] = int(line[3])
-                elif line[2] == "P2_MAX_TURNS":
-                    self.game_config["p2_max_turns"] = int(line[3])
-                elif line[2] == "PLAYER_INITIAL_LOCATION" and line[0] == "Player 1":
-                    self.game_config["p1_initial_location"] = [int(c) for c in line[3].split(",")]
-                    self.start_gameboard[self.game_config["p1_initial_location"][0],
-                                         self.game_config["p1_initial_location"][1]] = "P1"
-                elif line[2] == "PLAYER_INITIAL_LOCATION" and line[0] == "Player 2":
-                    self.game_config["p2_initial_location"] = [int(c) for c in line[3].split(",")]
-                    self.start_gameboard[self.game_config["p2_initial_location"][0],
-                                         self.game_config["p2_initial_location"][1]] = "P2"
-                # Handle remaining moves, disregarding metadata
-                elif line[2] not in ["ORIGINAL_FILENAME", "COLLECTION_SITE", "TASK_COMPLETED",
-                                     "PLAYER_1", "PLAYER_2", "PLAYER_1_TASK_ID", "PLAYER_2_TASK_ID", "GOAL_DESCRIPTION"]:
-                    # Check if card mention present
-                    if line[2] == "CHAT_MESSAGE_PREFIX":
-                        mentions_card = mentions_cards(line[3].lower(), self.tokenizer, self.card_expressions)
-                    else:
-                        mentions_card = False
-                    move = Move(line[0], line[2], line[3], mentions_card)
-                    self.all_moves.append(move)
+        file_reader = cached_rows(self.transcript, cache)
+        if file_reader is None:
+            with open(self.transcript) as f:
+                self._process_lines(csv.reader(f))
+        else:
+            self._process_lines(file_reader)
+
+    def _process_lines(self, file_reader):
+        """
+        Build the game from the rows of a transcript
+        :param file_reader: Iterable of [agent, time, action, contents] lists
+        :return:
+        """
+        for line in file_reader:
+            # Sight radii are game settings, but stay moves of all_moves
+            # below so that move indexes are those of the transcript
+            if line[2] in ("P1_MAX_LINEOFSIGHT", "P2_MAX_LINEOFSIGHT"):
+                self.game_config[line[2].lower()] = int(line[3])
+
+            if line[2] == "CREATE_ENVIRONMENT":
+                self._recreate_start_gameboard(line[3])
+            elif line[2] == "P1_MAX_CARDS":
+                self.game_config["p1_max_cards"] = int(line[3])
+            elif line[2] == "P2_MAX_CARDS":
+                self.game_config["p2_max_cards"] = int(line[3])
+            elif line[2] == "P1_MAX_TURNS":
+                self.game_config["p1_max_turns"] = int(line[3])
+            elif line[2] == "P2_MAX_TURNS":
+                self.game_config["p2_max_turns"] = int(line[3])
+            elif line[2] == "PLAYER_INITIAL_LOCATION" and line[0] == "Player 1":
+                self.game_config["p1_initial_location"] = [int(c) for c in line[3].split(",")]
+            elif line[2] == "PLAYER_INITIAL_LOCATION" and line[0] == "Player 2":
+                self.game_config["p2_initial_location"] = [int(c) for c in line[3].split(",")]
+            # Handle remaining moves, disregarding metadata
+            elif line[2] not in METADATA_ACTIONS:
+                # Check if card mention present
+                if line[2] == "CHAT_MESSAGE_PREFIX":
+                    mentions_card = self.card_recognizer.mentions_card(line[3])
+                else:
+                    mentions_card = False
+                self.all_moves.add(line[0], line[2], line[3], mentions_card)
+
+    def initial_state(self):
+        """
+        State before any move has been made. Its card layout is the one the
+        transcript starts with, shared by every replay and never modified;
+        later changes to position_to_card do not affect it.
+        :return: GameState
+        """
+        return GameState(self.game_config["p1_initial_location"],
+                         self.game_config["p2_initial_location"],
+                         p1_cards=[],
+                         p2_cards=[],
+                         position_to_card=self._start_layout,
+                         gameboard=self.start_gameboard)
+
+    def state_at(self, k):
+        """
+        State after the first k moves, in time proportional to
+        checkpoint_interval rather than to k. The timeline is built on
+        first use; set checkpoint_interval before then to change it.
+        :param k: Number of moves into all_moves
+        :return: GameState; do not modify it, it shares structure with other states
+        """
+        if self._timeline is None or self._timeline.interval != self.checkpoint_interval:
+            self._timeline = GameTimeline(self, self.checkpoint_interval)
+        return self._timeline.state_at(k)
+
+    @property
+    def distance_engine(self):
+        """
+        DistanceEngine for this game's board, shared with every game
+        played on the same layout
+        """
+        if self._distance_engine is None:
+            self._distance_engine = engine_for(self.start_gameboard)
+        return self._distance_engine
+
+    def visibility_engine(self, player):
+        """
+        VisibilityEngine for this game's board and a player's sight radius
+        :param player: 1 or 2
+        :return: VisibilityEngine
+        :raises ValueError: If the transcript has no sight radius for the player
+        """
+        radius = self.game_config.get("p%d_max_lineofsight" % player)
+        if radius is None:
+            raise ValueError("%s has no P%d_MAX_LINEOFSIGHT row" % (self.transcript, player))
+        return visibility_engine_for(self.start_gameboard, radius)
+
+    def _visible_card_index(self, player):
+        """
+        Cards visible to a player after every number of moves, from one
+        replay of the game. The bitset of cells holding cards is kept up to
+        date move by move, and the visible cards are only recomputed, from
+        its AND with the player's visible cells, when the player moves or a
+        card is picked up or dropped.
+        :param player: 1 or 2
+        :return: List of len(all_moves) + 1 tuples of cards
+        """
+        engine = self.visibility_engine(player)
+        state = self.initial_state()
+        occupancy = engine.occupancy_mask(state.position_to_card)
+        loc = state.p1_loc if player == 1 else state.p2_loc
+        visible = tuple(engine.cards_in(engine.visible_mask(loc) & occupancy, state.position_to_card))
+        index = [visible]
+        for move in self.all_moves:
+            state = state.advance(move)
+            changed = move.move_type == "PLAYER_MOVE" and move.player == player
+            if move.move_type in CARD_MOVE_TYPES:
+                bit = 1 << engine.cell_index(move.coords)
+                if state.position_to_card.get((move.coords[0], move.coords[1])):
+                    occupancy |= bit
+                else:
+                    occupancy &= ~bit
+                changed = True
+            if changed:
+                loc = state.p1_loc if player == 1 else state.p2_loc
+                visible = tuple(engine.cards_in(engine.visible_mask(loc) & occupancy, state.position_to_card))
+            index.append(visible)
+        return index
+
+    def visible_cards(self, k, player):
+        """
+        Cards a player could see after the first k moves. The first call
+        for a player replays the game once; every call after that is a
+        lookup.
+        :param k: Number of moves into all_moves
+        :param player: 1 or 2
+        :return: List of cards, ordered by position
+        :raises ValueError: If the transcript has no sight radius for the player
+        """
+        index = self._visible_cards.get(player)
+        if index is None:
+            index = self._visible_cards[player] = self._visible_card_index(player)
+        return list(index[k])
 
     def step(self, num_moves=1, game_state=None):
         """
@@ -202,13 +747,7 @@ class Game(object):
         :return:
         """
         if not game_state:
-            # Initialize a starting game state
-            game_state = GameState(self.game_config["p1_initial_location"],
-                                   self.game_config["p2_initial_location"],
-                                   p1_cards=[],
-                                   p2_cards=[],
-                                   position_to_card=self.position_to_card,
-                                   gameboard=self.start_gameboard)
+            game_state = self.initial_state()
 
         for idx in range(game_state.idx, game_state.idx + num_moves):
             move = self.all_moves[idx]
@@ -220,26 +759,18 @@ class Game(object):
                     game_state.p2_loc = coords
             elif move.move_type == "PLAYER_PICKUP_CARD":
                 coords = move.coords
-                if move.player == 1:
-                    game_state.p1_cards.append(move.card)
-
-                elif move.player == 2:
-                    game_state.p2_cards.append(move.card)
+                if move.player == 1 or move.player == 2:
+                    game_state.writable_hand(move.player).append(move.card)
 
-                game_state.position_to_card[(coords[0], coords[1])].remove(move.card)
+                game_state.writable_bucket(coords).remove(move.card)
             elif move.move_type == "PLAYER_DROP_CARD":
                 coords = move.coords
-                if move.player == 1:
+                if move.player == 1 or move.player == 2:
                     try:
-                        game_state.p1_cards.remove(move.card)
+                        game_state.writable_hand(move.player).remove(move.card)
                     except Exception as e:
                         print e
-                elif move.player == 2:
-                    try:
-                        game_state.p2_cards.remove(move.card)
-                    except Exception as e:
-                        print e
-                game_state.position_to_card[(coords[0], coords[1])].append(move.card)
+                game_state.writable_bucket(coords).append(move.card)
 
 
         game_state.idx += num_moves
@@ -247,21 +778,14 @@ class Game(object):
 
     def game_state_evolve(self, start, end):
         """
-        Return a list of game state objects
+        Return the game states from move start to move end. Successive
+        states share everything a move does not change, and are built
+        lazily as the returned sequence is accessed.
         :param start: Which move number to start at
         :param end: Which move number to end at
-        :return:
+        :return: GameStateHistory (indexable and iterable like a list)
         """
-        gamestate_list = []
-        start_game_state = self.step(num_moves=start)
-        gamestate_list.append(start_game_state)
-        curr_game_state = start_game_state
-        for _ in range(end - start):
-            next = self.step(num_moves=1, game_state=copy.deepcopy(curr_game_state))
-            gamestate_list.append(next)
-            curr_game_state = next
-
-        return gamestate_list
+        return GameStateHistory(self, start, end)
 
 
     def __str__(self):
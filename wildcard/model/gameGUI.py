@@ -3,6 +3,8 @@ import pygame
 import sys
 
 from pygame.locals import *
+from wildcard.model.board import BLOCKED
+from wildcard.model.board import WALL
 from wildcard.model.game import Game
 from wildcard.model.game import GameState
 from wildcard.model.game import Move
@@ -69,25 +71,24 @@ class CardsGame:
 					pygame.draw.rect(self.canvas, self.colors[ "LIGHT-YELLOW" ] , (y,x,self.grid_square_length,self.grid_square_length))
 					self.canvas.blit(self.card_font.render(card_name,True,self.colors["BLACK"]),(y,x))
 
-				if type(entry) == int:
-					if entry > 0:
-						pygame.draw.rect(self.canvas, self.colors[ "BLACK" ] , (x,y,self.grid_square_length,self.grid_square_length))
-					elif entry < 0:
-						pygame.draw.rect(self.canvas, self.colors[ "GRAY" ] , (x,y,self.grid_square_length,self.grid_square_length))
-				else:
-					if entry == "P1":
-						self.p1_position = i,j
-						pygame.draw.rect(self.canvas, self.colors[ "CRIMSON" ] , (x,y,self.grid_square_length,self.grid_square_length))
-						self.canvas.blit(self.player_font.render('P1',True,self.colors["BLACK"]),(x,y))
-					elif entry == "P2":
-						self.p2_position = i,j
-						pygame.draw.rect(self.canvas, self.colors[ "LIGHT-BLUE" ] , (x,y,self.grid_square_length,self.grid_square_length))
-						self.canvas.blit(self.player_font.render('P2',True,self.colors["BLACK"]),(x,y))
-					else: ## to implement: account for case where p1 and p2 are in the same square
-						self.p1_position = i,j
-						self.p2_position = i,j
-						pygame.draw.rect(self.canvas, self.colors[ "GREEN" ] , (x,y,self.grid_square_length,self.grid_square_length))
-						self.canvas.blit(self.player_font.render('B',True,self.colors["BLACK"]),(x,y))
+				if entry == WALL:
+					pygame.draw.rect(self.canvas, self.colors[ "BLACK" ] , (x,y,self.grid_square_length,self.grid_square_length))
+				elif entry == BLOCKED:
+					pygame.draw.rect(self.canvas, self.colors[ "GRAY" ] , (x,y,self.grid_square_length,self.grid_square_length))
+
+		## players are not on the board, so draw them at their initial locations
+		self.p1_position = tuple(self.game.game_config["p1_initial_location"])
+		self.p2_position = tuple(self.game.game_config["p2_initial_location"])
+		if self.p1_position == self.p2_position:
+			i,j = self.p1_position
+			x,y=(j*self.grid_square_length,i*self.grid_square_length)
+			pygame.draw.rect(self.canvas, self.colors[ "GREEN" ] , (x,y,self.grid_square_length,self.grid_square_length))
+			self.canvas.blit(self.player_font.render('B',True,self.colors["BLACK"]),(x,y))
+		else:
+			for (i,j), color, name in [(self.p1_position, "CRIMSON", 'P1'), (self.p2_position, "LIGHT-BLUE", 'P2')]:
+				x,y=(j*self.grid_square_length,i*self.grid_square_length)
+				pygame.draw.rect(self.canvas, self.colors[ color ] , (x,y,self.grid_square_length,self.grid_square_length))
+				self.canvas.blit(self.player_font.render(name,True,self.colors["BLACK"]),(x,y))
 
     def render_move(self,reverse=False):
         move = self.game.all_moves[ self.move_index ]
@@ -96,7 +97,11 @@ class CardsGame:
             print move
             if move.player == 1:
                 i_prev,j_prev = self.p1_position
-                i,j = move.coords
+                if not reverse:
+                    i,j = move.coords
+                else:
+                    ## step back to where the player was before this move
+                    i,j = self.game.state_at(self.move_index).p1_loc
                 self.p1_position =(i,j)
 
                 x_prev,y_prev=j_prev*self.grid_square_length,i_prev*self.grid_square_length
@@ -127,7 +132,11 @@ class CardsGame:
                 self.canvas.blit(self.player_font.render('P1',True,self.colors["BLACK"]),(x,y))
             else:
                 i_prev,j_prev = self.p2_position
-                i,j = move.coords
+                if not reverse:
+                    i,j = move.coords
+                else:
+                    ## step back to where the player was before this move
+                    i,j = self.game.state_at(self.move_index).p2_loc
                 self.p2_position =(i,j)
 
                 x_prev,y_prev=j_prev*self.grid_square_length,i_prev*self.grid_square_length
@@ -223,8 +232,6 @@ class CardsGame:
 
                 elif event.key == K_LEFT:
                     if self.move_index > 0:
-                        # TODO: Fix bug here whereby reenacting previous move isn't possible because
-                        # player is at different spot on the board
                         self.move_index -= 1
                         self.render_move(reverse=True)
 
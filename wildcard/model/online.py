@@ -0,0 +1,252 @@
+import cPickle as pickle
+import copy
+import json
+import math
+import numpy as np
+import sys
+import time
+
+from collections import deque
+
+"""
+Online scoring of chat messages with a trained CGModel. A predictor keeps,
+for every live dialogue, the n-gram counts of its context and the running
+dot product of those counts with the classifier's weights, so scoring a
+new message only tokenizes that message. N-grams, columns and weights come
+from the model's own vectorizer and classifier, so the online score of a
+message equals CGModel.predict() on the dialogue up to and including it.
+"""
+
+
+def save_model(model, path):
+    """
+    Serialize a trained model, without the training features it may
+    keep for refit()
+    :param model: Trained CGModel
+    :param path: File to write
+    :return:
+    """
+    model = copy.copy(model)
+    model.train_x, model.train_y = None, None
+    with open(path, "wb") as f:
+        pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_model(path):
+    """
+    Load a model written by save_model()
+    :param path: File to read
+    :return: CGModel
+    """
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+class LatencyHistogram(object):
+    """
+    Counts of latencies in power-of-two buckets of microseconds: bucket b
+    holds latencies in [2^(b-1), 2^b) us, bucket 0 those under 1 us
+    """
+    num_buckets = 40
+
+    def __init__(self):
+        self.counts = np.zeros(self.num_buckets, dtype=np.int64)
+        self.total = 0.
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def record(self, seconds):
+        microseconds = int(seconds * 1e6)
+        self.counts[min(microseconds.bit_length(), self.num_buckets - 1)] += 1
+        self.total += seconds
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the q-th percentile, in microseconds
+        """
+        if not len(self):
+            return 0
+        rank = int(math.ceil(q / 100. * len(self)))
+        bucket = np.searchsorted(np.cumsum(self.counts), max(rank, 1))
+        return 2 ** bucket
+
+    def format(self):
+        """
+        Text rendering of the nonempty buckets and summary statistics
+        """
+        lines = []
+        if len(self):
+            peak = self.counts.max()
+            for bucket in np.flatnonzero(self.counts):
+                low = 2 ** (bucket - 1) if bucket else 0
+                lines.append("%8d-%-8d us %8d %s" % (low, 2 ** bucket, self.counts[bucket],
+                                                     "#" * int(math.ceil(40. * self.counts[bucket] / peak))))
+            lines.append("count=%d mean=%.1fus p50<=%dus p99<=%dus" % (
+                len(self), 1e6 * self.total / len(self), self.percentile(50), self.percentile(99)))
+        else:
+            lines.append("count=0")
+        return "\n".join(lines)
+
+
+class DialogueState(object):
+    """
+    N-gram counts and score of one dialogue's context
+    """
+    __slots__ = ("tail", "turns", "first_turn", "num_turns", "counts", "score")
+
+    def __init__(self, intercept):
+        # Last tokens seen, as (token, turn number), for n-grams across turns
+        self.tail = deque()
+        # Columns of the n-gram occurrences starting in each kept turn
+        self.turns = deque()
+        self.first_turn = 0
+        self.num_turns = 0
+        self.counts = {}
+        self.score = intercept
+
+
+class OnlinePredictor(object):
+    """
+    Incremental scorer of the dialogues of live games
+    """
+    def __init__(self, model, window=None):
+        """
+        :param model: Trained CGModel whose classifier is linear (has coef_
+                      and intercept_, e.g. LogisticRegression)
+        :param window: Keep only this many of the most recent turns in a
+                       dialogue's context, as parse_annotations' window
+                       (default: the whole dialogue)
+        """
+        classifier = model.classifier
+        if not hasattr(classifier, "coef_") or len(classifier.classes_) != 2:
+            raise ValueError("OnlinePredictor needs a trained binary linear classifier")
+        self.vectorizer = model.count_vectorizer
+        self.weights = classifier.coef_[0]
+        self.intercept = float(classifier.intercept_[0])
+        self.classes = classifier.classes_
+        self.window = window
+        self.dialogues = {}
+        self.latency = LatencyHistogram()
+
+    def _occurrences(self, state, tokens):
+        """
+        N-grams ending in the new tokens of a turn
+        :return: (n-grams, turn number of the first token of each)
+        """
+        min_n, max_n = self.vectorizer.ngram_range
+        turn = state.num_turns
+        tail = state.tail
+        grams, first_turns = [], []
+        for token in tokens:
+            tail.append((token, turn))
+            if len(tail) > max_n:
+                tail.popleft()
+            length = len(tail)
+            for n in range(min_n, min(max_n, length) + 1):
+                gram = [tail[i] for i in range(length - n, length)]
+                grams.append(" ".join(t for t, _ in gram))
+                first_turns.append(gram[0][1])
+        return grams, first_turns
+
+    def _add(self, state, column, delta):
+        count = state.counts.get(column, 0) + delta
+        if count:
+            state.counts[column] = count
+        else:
+            del state.counts[column]
+        state.score += delta * self.weights[column]
+
+    def _decision(self, state, message):
+        """
+        Add a message to a dialogue and return its decision function
+        """
+        grams, first_turns = self._occurrences(state, self.vectorizer._tokenize(message))
+        state.turns.append([])
+        for column, first_turn in zip(self.vectorizer._columns(grams, False), first_turns):
+            # Skip unknown n-grams and those starting in turns out of the window
+            if column < 0 or first_turn < state.first_turn:
+                continue
+            state.turns[first_turn - state.first_turn].append(column)
+            self._add(state, column, 1)
+        state.num_turns += 1
+
+        if self.window is not None:
+            while len(state.turns) > self.window:
+                for column in state.turns.popleft():
+                    self._add(state, column, -1)
+                state.first_turn += 1
+        return state.score
+
+    def observe(self, dialogue, message):
+        """
+        Add a chat message to a dialogue and score its context
+        :param dialogue: Key of the dialogue, e.g. the game's id
+        :param message: Text of the message
+        :return: (probability of label 1, predicted label)
+        """
+        start = time.time()
+        state = self.dialogues.get(dialogue)
+        if state is None:
+            state = self.dialogues[dialogue] = DialogueState(self.intercept)
+        decision = self._decision(state, message)
+        probability = 1. / (1. + math.exp(-decision)) if decision > -500 else 0.
+        label = self.classes[int(decision > 0)]
+        self.latency.record(time.time() - start)
+        return probability, label
+
+    def reset(self, dialogue):
+        """
+        Forget a dialogue, e.g. at the end of its game
+        """
+        self.dialogues.pop(dialogue, None)
+
+    def serve(self, lines, out):
+        """
+        Answer JSON requests, one per line:
+        {"dialogue": key, "message": text} is answered with
+        {"dialogue": key, "probability": p, "label": l, "latency_us": t};
+        {"dialogue": key, "reset": true} forgets the dialogue and is
+        answered with {"dialogue": key, "reset": true}. A malformed request
+        is answered with {"error": message}.
+        :param lines: Iterable of request lines, e.g. sys.stdin
+        :param out: File to write responses to, flushed after each
+        :return:
+        """
+        # readline() rather than iterating a file, which reads ahead in
+        # blocks and would hold requests back
+        for line in iter(lines.readline, "") if hasattr(lines, "readline") else lines:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                dialogue = request["dialogue"]
+                if request.get("reset"):
+                    self.reset(dialogue)
+                    response = {"dialogue": dialogue, "reset": True}
+                else:
+                    start = time.time()
+                    probability, label = self.observe(dialogue, request["message"])
+                    response = {"dialogue": dialogue, "probability": probability,
+                                "label": label.item() if hasattr(label, "item") else label,
+                                "latency_us": int((time.time() - start) * 1e6)}
+            except (ValueError, KeyError, TypeError) as e:
+                response = {"error": "%s: %s" % (type(e).__name__, e)}
+            out.write(json.dumps(response) + "\n")
+            out.flush()
+
+
+def serve_stdio(model, window=None):
+    """
+    Serve requests from stdin to stdout (see OnlinePredictor.serve()), and
+    write the latency histogram to stderr at the end of input
+    :param model: Trained CGModel
+    :param window: See OnlinePredictor
+    :return: The OnlinePredictor
+    """
+    predictor = OnlinePredictor(model, window)
+    try:
+        predictor.serve(sys.stdin, sys.stdout)
+    finally:
+        sys.stderr.write(predictor.latency.format() + "\n")
+    return predictor
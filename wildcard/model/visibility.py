@@ -0,0 +1,189 @@
+import binascii
+import numpy as np
+
+from collections import OrderedDict
+from wildcard.model.board import board_hash
+from wildcard.model.board import free_cells
+
+"""
+Which cells a player can see. A cell is visible from another if it lies
+within the sight radius (Euclidean, in cells) and the straight line
+between them, traced with Bresenham's algorithm, passes through no cell
+other than open space. Visibility from every cell is precomputed once per
+board and radius and stored as a bitset over flat cell indices (row *
+num_cols + col), like the card masks in model_utils. Players only stand on
+open cells, so nothing is visible from a wall or blocked cell.
+"""
+
+# Number of (board, radius) pairs whose engines are kept by visibility_engine_for()
+max_engines = 64
+_engines = OrderedDict()
+
+
+def visibility_engine_for(board, radius):
+    """
+    Visibility engine for a board and sight radius, shared by every board
+    with the same layout
+    :param board: Board array (see board.py)
+    :param radius: Sight radius in cells, e.g. game_config["p1_max_lineofsight"]
+    :return: VisibilityEngine
+    """
+    key = (board_hash(board), radius)
+    engine = _engines.pop(key, None)
+    if engine is None:
+        engine = VisibilityEngine(board, radius)
+    _engines[key] = engine
+    while len(_engines) > max_engines:
+        _engines.popitem(last=False)
+    return engine
+
+
+def line_cells(a, b):
+    """
+    Cells strictly between a and b on the Bresenham line from a to b
+    :param a: (row, col) position
+    :param b: (row, col) position
+    :return: List of (row, col) positions
+    """
+    r, c = a
+    dr, dc = abs(b[0] - r), abs(b[1] - c)
+    sr = 1 if b[0] > r else -1
+    sc = 1 if b[1] > c else -1
+    err = dr - dc
+    cells = []
+    while (r, c) != (b[0], b[1]):
+        e2 = 2 * err
+        if e2 > -dc:
+            err -= dc
+            r += sr
+        if e2 < dr:
+            err += dr
+            c += sc
+        cells.append((r, c))
+    return cells[:-1]
+
+
+def _bitset(flags):
+    """
+    Int with bit i set where flags[i] is true
+    """
+    padded = np.zeros(-(-len(flags) // 8) * 8, dtype=bool)
+    padded[:len(flags)] = flags
+    return int(binascii.hexlify(np.packbits(padded[::-1]).tobytes()) or "0", 16)
+
+
+class VisibilityEngine(object):
+    """
+    Cells visible from each cell of one board for one sight radius
+    """
+    def __init__(self, board, radius):
+        """
+        :param board: Board array (see board.py)
+        :param radius: Sight radius in cells
+        """
+        self.shape = board.shape
+        self.radius = radius
+        free = free_cells(board)
+        rows, cols = self.shape
+
+        # free shifted by a relative cell (dr, dc): whether cell
+        # (r + dr, c + dc) is open, for every (r, c) of the board
+        padded = np.zeros((rows + 2 * radius, cols + 2 * radius), dtype=bool)
+        padded[radius:radius + rows, radius:radius + cols] = free
+        inside = np.zeros_like(padded)
+        inside[radius:radius + rows, radius:radius + cols] = True
+
+        def shifted(grid, dr, dc):
+            return grid[radius + dr:radius + dr + rows, radius + dc:radius + dc + cols]
+
+        # Whether the line through a sequence of relative cells is clear from
+        # every source cell. Lines share prefixes, so each is extended from
+        # its prefix by one array AND.
+        clear = {(): free}
+
+        def clear_along(path):
+            result = clear.get(path)
+            if result is None:
+                result = clear[path] = clear_along(path[:-1]) & shifted(padded, *path[-1])
+            return result
+
+        # visible[i] has bit j set if cell j can be seen from cell i
+        reach = np.zeros((rows * cols, rows * cols), dtype=bool)
+        sources = np.arange(rows * cols).reshape(rows, cols)
+        for dr in range(-radius, radius + 1):
+            for dc in range(-radius, radius + 1):
+                if dr * dr + dc * dc > radius * radius:
+                    continue
+                path = tuple(line_cells((0, 0), (dr, dc)))
+                seen = clear_along(path) & shifted(inside, dr, dc)
+                reach[sources[seen], sources[seen] + dr * cols + dc] = True
+        self.visible = [_bitset(row) for row in reach]
+    def cell_index(self, pos):
+        """
+        Flat index of a (row, col) position
+        """
+        return pos[0] * self.shape[1] + pos[1]
+
+    def visible_mask(self, pos):
+        """
+        Bitset of the cells visible from pos
+        :param pos: (row, col) position
+        :return: Int
+        """
+        return self.visible[self.cell_index(pos)]
+
+    def can_see(self, a, b):
+        """
+        Whether b is visible from a
+        :param a: (row, col) position
+        :param b: (row, col) position
+        :return: Bool
+        """
+        return bool(self.visible_mask(a) >> self.cell_index(b) & 1)
+
+    def visible_cells(self, pos):
+        """
+        Cells visible from pos
+        :param pos: (row, col) position
+        :return: List of (row, col) positions, in row-major order
+        """
+        mask = self.visible_mask(pos)
+        return [divmod(i, self.shape[1]) for i in range(self.shape[0] * self.shape[1])
+                if mask >> i & 1]
+
+    def occupancy_mask(self, position_to_card):
+        """
+        Bitset of the cells holding at least one card
+        :param position_to_card: Dict of (row, col) -> list of cards
+        :return: Int
+        """
+        mask = 0
+        for p, cards in position_to_card.items():
+            if cards:
+                mask |= 1 << self.cell_index(p)
+        return mask
+
+    def cards_in(self, mask, position_to_card):
+        """
+        Cards on the cells of a bitset, visiting only its set bits
+        :param mask: Bitset of cells
+        :param position_to_card: Dict of (row, col) -> list of cards
+        :return: List of cards, ordered by position
+        """
+        cards = []
+        while mask:
+            low = mask & -mask
+            cards.extend(position_to_card.get(divmod(low.bit_length() - 1, self.shape[1]), []))
+            mask ^= low
+        return cards
+
+    def visible_cards(self, pos, position_to_card):
+        """
+        Cards visible from pos. This walks the layout once; to query many
+        moves of a game, use Game.visible_cards().
+        :param pos: (row, col) position
+        :param position_to_card: Dict of (row, col) -> list of cards
+        :return: List of cards, ordered by position
+        """
+        return self.cards_in(self.visible_mask(pos) & self.occupancy_mask(position_to_card),
+                             position_to_card)
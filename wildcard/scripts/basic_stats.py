@@ -3,8 +3,11 @@ import numpy as np
 import os
 import re
 
+from wildcard.model.game import SETUP_ACTIONS
+from wildcard.model.game import move_message
 from wildcard.util.cards import Tokenizer
-from wildcard.util.game import Game
+from wildcard.util.cards import Transcript
+from wildcard.util.cards import UTTERANCE
 
 
 """
@@ -77,35 +80,49 @@ def process_all(data_dir):
     plt.savefig("../figures/message_histogram.png")
 
 
+def _rows_of(transcript, actions):
+    """
+    Rows of a transcript holding any of actions, in order
+    """
+    rows = [transcript.rows_of(action) for action in actions]
+    return np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
+
+
 def process_transcript(transcript_file, tokenizer):
     """
-    Process a single transcript file
+    Process a single transcript file. Moves and messages are those of
+    Game.all_moves, located with the transcript's per-action row index
+    instead of replaying the game.
     :param transcript_file: Path of transcript file to process
     :param tokenizer: Tokenizer for how to split up data utterances
     :return:
     """
-    game = Game(transcript_file)
-    tokens = set()
-    messages = 0
-
-    message_histogram = np.zeros(num_intervals)
-    interval_bins = np.rint(np.linspace(0, len(game.all_moves), num_intervals + 1))
+    transcript = Transcript(transcript_file)
+    actions = [action for action in transcript.count_by_action() if action not in SETUP_ACTIONS]
+    move_rows = _rows_of(transcript, actions)
+    # Whether a move has a message depends only on its action
+    message_actions = [action for action in actions if move_message(action, "") is not None]
+    message_rows = _rows_of(transcript, message_actions)
 
-    for idx, move in enumerate(game.all_moves):
-        if move.message is not None:
-            messages += 1
-            message = re.sub("--", "", move.message)
-            t = tokenizer.tokenize(message)
-            tokens.update([tok.lower() for tok in t])
-
-            # Keep track of what interval of game a message was made
-            for i in range(num_intervals + 1):
-                if idx < interval_bins[i]:
-                    message_histogram[i - 1] += 1
-                    break
-
-    return tokens, len(game.all_moves), messages, message_histogram
-
-
-root_dir = os.path.join(os.path.dirname(os.path.abspath(".")), "data/CardsCorpus-v02/transcripts")
-process_all(root_dir)
\ No newline at end of file
+    tokens = set()
+    for action in message_actions:
+        if action == UTTERANCE:
+            messages = [move_message(action, event.contents) for event in transcript.events_of(action)]
+        else:
+            # The same message for every move of the action
+            messages = [move_message(action, None)]
+        for message in messages:
+            tokens.update([tok.lower() for tok in tokenizer.tokenize(re.sub("--", "", message))])
+
+    # Keep track of what interval of game each message was made
+    interval_bins = np.rint(np.linspace(0, len(move_rows), num_intervals + 1))
+    move_index = np.searchsorted(move_rows, message_rows)
+    interval = np.searchsorted(interval_bins, move_index, side="right") - 1
+    message_histogram = np.bincount(interval, minlength=num_intervals)[:num_intervals].astype(np.float64)
+
+    return tokens, len(move_rows), len(message_rows), message_histogram
+
+
+if __name__ == "__main__":
+    root_dir = os.path.join(os.path.dirname(os.path.abspath(".")), "data/CardsCorpus-v02/transcripts")
+    process_all(root_dir)
@@ -0,0 +1,56 @@
+import copy
+import random
+import timeit
+
+from wildcard.util.model_utils import _compute_ed_sets
+from wildcard.util.model_utils import compute_ed
+from wildcard.util.model_utils import compute_window
+
+"""
+Benchmark of the table/bitmask compute_ed against the set-based
+reference implementation, on random hands
+"""
+
+num_examples = 5000
+ranks = ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K"]
+
+
+def random_examples(n, seed=42):
+    """
+    Random (hands, coi) pairs shaped like the annotated data
+    :param n: Number of examples
+    :param seed: Random seed
+    :return:
+    """
+    rng = random.Random(seed)
+    cards = [str(v) + s for v in range(1, 14) for s in "HDSC"] + [r + s for r in ranks for s in "HDSC"]
+    examples = []
+    for _ in range(n):
+        hands = {"1": [rng.choice(cards) for _ in range(rng.randint(0, 3))] + [""],
+                 "2": [rng.choice(cards) for _ in range(rng.randint(0, 3))]}
+        coi = rng.choice(ranks) + rng.choice("HDSC")
+        examples.append((hands, coi))
+    return examples
+
+
+def run(fn, examples):
+    for hands, coi in examples:
+        fn(hands, coi)
+
+
+if __name__ == "__main__":
+    examples = random_examples(num_examples)
+
+    # Results must be identical
+    for hands, coi in examples:
+        assert compute_ed(copy.deepcopy(hands), coi) == _compute_ed_sets(copy.deepcopy(hands), coi)
+    print "compute_ed matches reference on {0} examples".format(num_examples)
+
+    reference = min(timeit.repeat(lambda: run(_compute_ed_sets, examples), number=1, repeat=5))
+    bitmask = min(timeit.repeat(lambda: run(compute_ed, examples), number=1, repeat=5))
+    print "Reference: {0:.2f} us/call".format(1e6 * reference / num_examples)
+    print "Bitmask: {0:.2f} us/call".format(1e6 * bitmask / num_examples)
+    print "Speedup: {0:.1f}x".format(reference / bitmask)
+
+    window = min(timeit.repeat(lambda: compute_window("Q"), number=10000, repeat=5))
+    print "compute_window: {0:.2f} us/call".format(1e6 * window / 10000)
@@ -0,0 +1,30 @@
+import argparse
+
+from wildcard.model.cross_validation import cross_validate
+from wildcard.model.cross_validation import format_table
+from wildcard.model.cross_validation import summarize
+from wildcard.util.parse_annotations import parse_all
+
+"""
+Script for cross-validating the common ground models over a grid of
+regularization strengths
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validate CGModel and LinearCGModel")
+    parser.add_argument("annotation_dir", help="Directory of annotation files")
+    parser.add_argument("--folds", type=int, default=5, help="Number of folds (default: 5)")
+    parser.add_argument("--C", type=float, nargs="+", default=[0.1, 1.0, 10.0],
+                        help="Inverse regularization strengths of CGModel")
+    parser.add_argument("--ungrouped", action="store_true",
+                        help="Split examples at random instead of by transcript")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of worker processes (default: every core)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the fold assignment")
+    args = parser.parse_args()
+
+    utterances = parse_all(args.annotation_dir, processes=args.processes, verbose=False)
+    grids = {"CGModel": {"C": args.C}, "LinearCGModel": {}}
+    results = cross_validate(utterances, args.folds, grids, grouped=not args.ungrouped,
+                             processes=args.processes, seed=args.seed)
+    print format_table(summarize(results))
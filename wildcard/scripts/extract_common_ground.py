@@ -0,0 +1,22 @@
+import argparse
+
+from wildcard.model.common_ground import extract_corpus
+from wildcard.util.cards import Corpus
+
+"""
+Script for writing the common-ground shards of a whole corpus. Run it again
+after an interruption to finish the remaining transcripts.
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract common-ground state from game replays")
+    parser.add_argument("corpus_dir", help="Root of the corpus transcripts")
+    parser.add_argument("out_dir", help="Directory for the per-transcript shards")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of worker processes (default: every core)")
+    args = parser.parse_args()
+
+    errors = extract_corpus(Corpus(args.corpus_dir), args.out_dir, processes=args.processes)
+    for transcript, error in sorted(errors.items()):
+        print transcript
+        print error
@@ -0,0 +1,31 @@
+import argparse
+
+from wildcard.model.cg_model import CGModel
+from wildcard.model.online import load_model
+from wildcard.model.online import save_model
+from wildcard.model.online import serve_stdio
+from wildcard.util.parse_annotations import parse_all
+
+"""
+Script for scoring live chat messages with a trained CGModel. Requests are
+read from stdin and answered on stdout, one JSON object per line, e.g.
+{"dialogue": "game1", "message": "I see the 4H"}; see
+OnlinePredictor.serve(). The latency histogram goes to stderr at the end.
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve CGModel predictions over stdin/stdout")
+    parser.add_argument("model_path", help="Model written by online.save_model()")
+    parser.add_argument("--train", metavar="ANNOTATION_DIR",
+                        help="First train a model on this directory and save it to model_path")
+    parser.add_argument("--window", type=int, default=None,
+                        help="Number of most recent turns in a dialogue's context (default: all)")
+    args = parser.parse_args()
+
+    if args.train is not None:
+        model = CGModel()
+        model.train(parse_all(args.train, window=args.window, verbose=False))
+        save_model(model, args.model_path)
+    else:
+        model = load_model(args.model_path)
+    serve_stdio(model, args.window)
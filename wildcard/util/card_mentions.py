@@ -0,0 +1,212 @@
+from collections import deque
+from collections import namedtuple
+from wildcard.util.cards import Tokenizer
+from wildcard.util.model_utils import card_expressions
+
+"""
+Recognizer for card references in chat messages. An Aho-Corasick
+automaton over tokens finds every card expression in one pass over an
+utterance, including multi-word forms like "four of hearts".
+"""
+
+rank_names = {"two": "2", "three": "3", "four": "4", "five": "5", "six": "6",
+              "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+              "jack": "J", "queen": "Q", "king": "K", "ace": "A"}
+rank_symbols = {"2": "2", "3": "3", "4": "4", "5": "5", "6": "6", "7": "7",
+                "8": "8", "9": "9", "10": "10", "j": "J", "q": "Q", "k": "K", "a": "A"}
+suit_names = {"heart": "H", "hearts": "H", "diamond": "D", "diamonds": "D",
+              "spade": "S", "spades": "S", "club": "C", "clubs": "C"}
+suit_symbols = {"h": "H", "d": "D", "s": "S", "c": "C"}
+
+# Compact forms that are also common words ("as soon as", "ah ok", "ha").
+# They only count as cards next to card context, see CardRecognizer.find()
+ambiguous_expressions = frozenset(["as", "ad", "ah", "ha", "da", "ca"])
+# Tokens that are card context, and those skipped when looking for it, as
+# in lists like "4h, kd and as"
+context_words = frozenset(["card", "cards"])
+list_separators = frozenset(["and", "or", ",", "/", "&"])
+
+# A mention of a card: token span [start, end) of the utterance, the character
+# span [char_start, char_end) of its lowercased text, and the normalized card,
+# e.g. "4H". An unknown rank or suit is written "X", as in the annotations
+# ("XH" for "hearts", "4X" for "four").
+CardMention = namedtuple("CardMention", ["start", "end", "char_start", "char_end", "card"])
+
+
+def card_id(tokens):
+    """
+    Normalized card for a sequence of lowercased tokens, or None
+    :param tokens: Tuple of tokens, e.g. ("four", "of", "hearts") or ("4h",)
+    :return: Card string like "4H", "XH" or "4X"
+    """
+    if len(tokens) == 3 and tokens[1] == "of":
+        rank = rank_names.get(tokens[0], rank_symbols.get(tokens[0]))
+        suit = suit_names.get(tokens[2])
+        if rank is not None and suit is not None:
+            return rank + suit
+        return None
+    if len(tokens) != 1:
+        return None
+
+    token = tokens[0]
+    if token in rank_names:
+        return rank_names[token] + "X"
+    if token in suit_names:
+        return "X" + suit_names[token]
+    # Compact forms like "4h", "10c" or "h4"
+    if token[:-1] in rank_symbols and token[-1:] in suit_symbols:
+        return rank_symbols[token[:-1]] + suit_symbols[token[-1]]
+    if token[:1] in suit_symbols and token[1:] in rank_symbols:
+        return rank_symbols[token[1:]] + suit_symbols[token[0]]
+    return None
+
+
+def multiword_expressions():
+    """
+    Multi-word card expressions of the form "<rank> of <suit>". Single
+    letters are left out as ranks ("a of hearts" is not a card). Each one
+    contains a word from card_expressions(), so adding them never changes
+    whether an utterance mentions a card.
+    :return: Set of token tuples
+    """
+    ranks = list(rank_names) + [r for r in rank_symbols if r.isdigit()]
+    return set((rank, "of", suit) for rank in ranks for suit in suit_names)
+
+
+class CardRecognizer(object):
+    """
+    Aho-Corasick automaton over token sequences. Build it once and call
+    find() or mentions_card() per utterance.
+    """
+    def __init__(self, expressions=None, tokenizer=None, ambiguous=None):
+        """
+        :param expressions: Iterable of single-token expressions (default: card_expressions())
+        :param tokenizer: Tokenizer used to split utterances (default: Tokenizer())
+        :param ambiguous: Expressions that find() only reports next to card
+                          context (default: ambiguous_expressions)
+        """
+        if expressions is None:
+            expressions = card_expressions()
+        self.tokenizer = tokenizer if tokenizer is not None else Tokenizer()
+        self.ambiguous = frozenset(ambiguous if ambiguous is not None else ambiguous_expressions)
+
+        # Every multi-word pattern contains one of these, so an utterance
+        # matches some pattern iff one of its tokens is in this set
+        self._words = frozenset(expressions)
+        patterns = set((e,) for e in self._words) | multiword_expressions()
+        # Per state: transitions, failure link, and (length, card) of each pattern ending there
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern in patterns:
+            self._add(pattern, card_id(pattern))
+        self._link()
+
+    def _add(self, pattern, card):
+        state = 0
+        for token in pattern:
+            nxt = self._goto[state].get(token)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][token] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(pattern), card))
+
+    def _link(self):
+        """
+        Compute failure links breadth first and merge the outputs of each
+        state's failure target into its own
+        """
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(token, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def _matches(self, tokens):
+        """
+        Yield (start, end, card) for every pattern occurrence in tokens,
+        overlapping ones included
+        """
+        state = 0
+        for i, token in enumerate(tokens):
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            for length, card in self._out[state]:
+                yield i + 1 - length, i + 1, card
+
+    def mentions_card(self, utterance):
+        """
+        Whether utterance contains any card expression. Gives the same
+        answer as model_utils.mentions_cards() with card_expressions(),
+        without walking the automaton, so ambiguous expressions count
+        here even where find() drops them.
+        :param utterance: Chat message
+        :return: Bool
+        """
+        return not self._words.isdisjoint(self.tokenizer.tokenize(utterance.lower()))
+
+    def find(self, utterance):
+        """
+        Find the card mentions in utterance. Where mentions overlap, the
+        leftmost and then longest one is kept, so "four of hearts" is one
+        mention (4H) rather than "four" and "hearts". An ambiguous
+        expression like "as" is only a mention when the token next to it,
+        past list separators, is another card mention or "card(s)": "the
+        kd and as" mentions AS, "as soon as" mentions nothing.
+        :param utterance: Chat message
+        :return: List of CardMention, in order of appearance
+        """
+        text = utterance.lower()
+        spans = [(m.start(1), m.end(1)) for m in Tokenizer.token_re.finditer(text)]
+        tokens = [text[s:e] for s, e in spans]
+
+        # Best (longest) match starting at each token
+        best = {}
+        for start, end, card in self._matches(tokens):
+            if start not in best or end > best[start][0]:
+                best[start] = (end, card)
+
+        mentions = []
+        position = 0
+        for start in sorted(best):
+            if start < position:
+                continue
+            end, card = best[start]
+            mentions.append(CardMention(start, end, spans[start][0], spans[end - 1][1], card))
+            position = end
+        return [m for m in mentions if tokens[m.start] not in self.ambiguous or
+                self._in_card_context(m, mentions, tokens)]
+
+    def _in_card_context(self, mention, mentions, tokens):
+        """
+        Whether the nearest token on either side of mention, skipping list
+        separators, is a card word or starts or ends an unambiguous mention
+        """
+        edges = set()
+        for m in mentions:
+            if tokens[m.start] not in self.ambiguous:
+                edges.update([m.start, m.end - 1])
+        for i, step in ((mention.start - 1, -1), (mention.end, 1)):
+            while 0 <= i < len(tokens) and tokens[i] in list_separators:
+                i += step
+            if 0 <= i < len(tokens) and (i in edges or tokens[i] in context_words):
+                return True
+        return False
+
+    def cards(self, utterance):
+        """
+        Normalized cards mentioned in utterance, e.g. ["4H", "XS"]
+        :param utterance: Chat message
+        :return: List of card strings
+        """
+        return [m.card for m in self.find(utterance)]
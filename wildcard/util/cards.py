@@ -25,8 +25,16 @@ import sys
 import csv
 import codecs
 import datetime
+import itertools
+import multiprocessing
+import numpy as np
 #import pytz
+from collections import Counter
 from glob import iglob
+try:
+    from functools import lru_cache
+except ImportError:
+    from functools32 import lru_cache
 
 ######################################################################
 ###### ACTIONS CAPTURED BY PRAGBOT TRANSCRIPTS
@@ -66,6 +74,9 @@ DROP               = r"PLAYER_DROP_CARD"
 TASK_COMPLETE      = r"TASK_COMPLETE_CLICKED"
 CLOSE_SOCKETS      = r"CLOSE_SOCKETS"
 
+# Sidecar file with the byte offset of every row; see build_offset_index()
+OFFSET_INDEX_SUFFIX = ".idx"
+
 ######################################################################
 
 class Corpus:
@@ -82,44 +93,177 @@ class Corpus:
     Corpus objects exist mainly as iterators. The methods
     iter_transcripts() and iter_events() allow you to move through the
     entire corpus efficiently.
+
+    If the corpus has been compiled with
+    wildcard.util.corpus_cache.CorpusCache.compile() and the cache is
+    still fresh, transcripts are read from the cache instead of the CSV
+    files.
     """
         
-    def __init__(self, dirname):
+    def __init__(self, dirname, cache_dir=None):
         """
         Argument:
         dirname -- the root of the corpus transcripts
+
+        Keyword argument:
+        cache_dir -- location of the compiled cache (default: dirname/.wildcard_cache)
         """
         self.dirname = dirname
+        self.cache_dir = cache_dir
 
-    def iter_transcripts(self, display_progress=True):
+    def load_cache(self):
+        """
+        Return the compiled cache of this corpus if it exists and is
+        fresh, else None.
+        """
+        from wildcard.util.corpus_cache import load_cache
+        cache = load_cache(self.dirname, self.cache_dir)
+        if cache is None or not cache.is_fresh():
+            return None
+        return cache
+
+    def iter_transcripts(self, display_progress=True, processes=1, ordered=True, chunksize=1, views=False,
+                         lazy=False):
         """
         Iterate through the transcripts, by yielding Transcript objects one-by-one.
 
-        Keyword argument:
-        display_progress -- should create an overwriting progress bar to stderr if set to True (default: True)        
+        Keyword arguments:
+        display_progress -- should create an overwriting progress bar to stderr if set to True (default: True)
+        processes -- number of worker processes that parse transcripts in parallel; 1 parses
+                     them in the calling process, None uses every available core (default: 1)
+        ordered -- if True, yield transcripts in glob order; otherwise yield each one as
+                   soon as a worker has finished it (default: True)
+        chunksize -- number of filenames dispatched to a worker at a time (default: 1)
+        views -- build the events of cached transcripts as memory-mapped EventView
+                 objects rather than Event instances (default: False)
+        lazy -- yield streaming Transcript(lazy=True) objects; ignored by the
+                worker processes, which always return parsed transcripts (default: False)
+
+        A fresh compiled cache is always read in the calling process,
+        since loading from it is cheaper than shipping Transcripts
+        between processes.
         """
-        trans_no = 1
-        for filename in iglob(os.path.join(self.dirname, '*/*.csv')):
+        filenames = iglob(os.path.join(self.dirname, '*/*.csv'))
+        pool = None
+        cache = self.load_cache()
+        if cache is not None:
+            transcripts = (Transcript(filename, cache=cache, views=views, lazy=lazy) for filename in cache.filenames)
+        elif processes == 1:
+            transcripts = (Transcript(filename, lazy=lazy) for filename in filenames)
+        else:
+            pool = multiprocessing.Pool(processes)
+            if ordered:
+                transcripts = pool.imap(_load_transcript, filenames, chunksize)
+            else:
+                transcripts = pool.imap_unordered(_load_transcript, filenames, chunksize)
+        try:
+            trans_no = 1
+            for trans in transcripts:
+                if display_progress:
+                    sys.stderr.write('\r') ; sys.stderr.write('transcript %s' % trans_no) ; sys.stderr.flush() ; trans_no += 1
+                yield trans
             if display_progress:
-                sys.stderr.write('\r') ; sys.stderr.write('transcript %s' % trans_no) ; sys.stderr.flush() ; trans_no += 1
-            yield Transcript(filename)
-        if display_progress:
-            sys.stderr.write('\n')
-
-    def iter_events(self, display_progress=True):
+                sys.stderr.write('\n')
+        finally:
+            # Also reached when the caller stops iterating early:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def iter_events(self, display_progress=True, processes=1, ordered=True, chunksize=1, views=False):
         """
         Iterate through the events, by yielding Event objects
         one-by-one.  This is useful if you don't need to rely on the
         transcripts as a unit --- say, because you're just counting
         words for the whole corpus.
 
-        Keyword argument:
-        display_progress -- should create an overwriting progress bar to stderr if set to True (default: True)        
+        Keyword arguments:
+        display_progress -- should create an overwriting progress bar to stderr if set to True (default: True)
+        processes, ordered, chunksize, views -- passed on to iter_transcripts()
+
+        Transcripts read in the calling process are streamed
+        (Transcript(lazy=True)), so only one event is held at a time.
+        With views=True and a fresh cache, Python memory stays roughly
+        constant however much of the corpus is scanned.
         """
-        for trans in self.iter_transcripts(display_progress=display_progress):
+        for trans in self.iter_transcripts(display_progress=display_progress, processes=processes,
+                                           ordered=ordered, chunksize=chunksize, views=views,
+                                           lazy=True):
             for event in trans.iter_events():
                 yield event
 
+    def count_by_action(self, display_progress=True):
+        """
+        Return a Counter mapping each action to its number of events in
+        the corpus. With a fresh cache this is a single np.bincount()
+        over the action column; otherwise the per-transcript counts of
+        Transcript.count_by_action() are summed.
+
+        Keyword argument:
+        display_progress -- as for iter_transcripts() (default: True)
+        """
+        counts = Counter()
+        cache = self.load_cache()
+        if cache is not None:
+            totals = np.bincount(cache.events['action'], minlength=len(cache.actions))
+            for action, total in zip(cache.actions, totals.tolist()):
+                if total:
+                    counts[action] = total
+            return counts
+        for trans in self.iter_transcripts(display_progress=display_progress):
+            counts.update(trans.count_by_action())
+        return counts
+
+
+def build_offset_index(filename):
+    """
+    Write the sidecar offset index of a transcript: a .npy file at
+    filename + OFFSET_INDEX_SUFFIX holding the byte offset at which each
+    row starts, followed by the size of the file. Lazy transcripts use
+    it to seek straight to a row. Returns the offsets.
+
+    Argument:
+    filename -- the source filename
+    """
+    offsets = []
+    with open(filename, 'rb') as f:
+        reader = csv.reader(iter(f.readline, b''))
+        while True:
+            offset = f.tell()
+            try:
+                next(reader)
+            except StopIteration:
+                break
+            offsets.append(offset)
+        offsets.append(f.tell())
+    offsets = np.array(offsets, dtype=np.int64)
+    with open(filename + OFFSET_INDEX_SUFFIX, 'wb') as f:
+        np.save(f, offsets)
+    return offsets
+
+def load_offset_index(filename):
+    """
+    Return the row offsets written by build_offset_index(), or None if
+    there is no sidecar or it is older than the transcript.
+
+    Argument:
+    filename -- the source filename
+    """
+    index_filename = filename + OFFSET_INDEX_SUFFIX
+    if not os.path.exists(index_filename) or os.path.getmtime(index_filename) < os.path.getmtime(filename):
+        return None
+    offsets = np.load(index_filename)
+    if len(offsets) == 0 or offsets[-1] != os.path.getsize(filename):
+        return None
+    return offsets
+
+def _load_transcript(filename):
+    """
+    Build a Transcript from filename. This lives at module level so
+    that Corpus.iter_transcripts() can hand it to worker processes.
+    """
+    return Transcript(filename)
+
 ######################################################################
 
 class Transcript:
@@ -133,28 +277,182 @@ class Transcript:
     want to study.
     """
     
-    def __init__(self, filename):
+    def __init__(self, filename, cache=None, views=False, lazy=False):
         """
         Argument:
         filename -- the source filename
 
+        Keyword arguments:
+        cache -- a CorpusCache to read the events from; None looks for a
+                 compiled cache in the default location of the corpus,
+                 False always reads the CSV file (default: None)
+        views -- if the events come from the cache, make self.events a lazy
+                 sequence of EventView objects over the memory-mapped
+                 records instead of a list of Event instances (default: False)
+        lazy -- do not read the file at all; events are parsed on demand by
+                iter_events() and self.events is None (default: False)
+
         At intialization, the code turns the filename contents into a
         CSV reader and then turns each row into an Event instance. The
         attribute self.events is an ordered list of those Event
-        instances.
+        instances. If a fresh cache entry exists for the file, the rows
+        come from the cache instead.
         """
+        from wildcard.util.corpus_cache import resolve_cache
         self.filename = filename
-        csvreader = csv.reader(codecs.open(self.filename, 'r', 'utf8'))
+        self._index = None
+        cache, index = resolve_cache(self.filename, cache)
+        if index is not None and views:
+            self.events = cache.event_views(index)
+            return
+        if lazy:
+            self.events = None
+            self._cache, self._cache_index = cache, index
+            return
+        if index is not None:
+            csvreader = cache.iter_rows(index)
+        else:
+            csvreader = csv.reader(codecs.open(self.filename, 'r', 'utf8'))
         self.events = []
         for row in csvreader:                
             self.events.append(Event(row))
 
-    def iter_events(self):
+    def iter_events(self, start=0, stop_at=None):
         """
-        Iterate through self.events.
+        Iterate through self.events, or for a lazy transcript parse the
+        events one at a time as they are requested.
+
+        Keyword arguments:
+        start -- number of leading events to skip; a lazy transcript seeks
+                 straight to the row when an offset index built with
+                 build_offset_index() is available (default: 0)
+        stop_at -- an action (e.g. TASK_COMPLETE); iteration ends right after
+                   the first event with this action, without reading the
+                   rest of the file (default: None)
         """
-        for event in iter(self.events):
+        if self.events is not None:
+            events = itertools.islice(self.events, start, None)
+        else:
+            events = itertools.imap(Event, self._iter_rows(start))
+        for event in events:
             yield event
+            if stop_at is not None and event.action == stop_at:
+                return
+
+    def _iter_rows(self, start=0):
+        """
+        Stream the raw rows of a lazy transcript, beginning with row start.
+        """
+        if self._cache_index is not None:
+            for row in self._cache.iter_rows(self._cache_index, first=start):
+                yield row
+            return
+        offsets = load_offset_index(self.filename)
+        with open(self.filename, 'rb') as f:
+            if start and offsets is not None:
+                f.seek(offsets[min(start, len(offsets) - 1)])
+                start = 0
+            for row in itertools.islice(csv.reader(iter(f.readline, b'')), start, None):
+                yield row
+
+    def _build_index(self):
+        """
+        Build, once, the arrays that the query methods below work on:
+        event times, integer action codes, and for every action the
+        rows where it occurs. Events read as views over the cache are
+        indexed straight from the record array, without a Python loop.
+        """
+        if self._index is not None:
+            return self._index
+        records = getattr(self.events, 'records', None)
+        if records is None and self.events is None and self._cache_index is not None:
+            start, stop = self._cache.event_range(self._cache_index)
+            records = self._cache.events[start:stop]
+        if records is not None:
+            actions = (self._cache if self.events is None else self.events.cache).actions
+            times = records['time'].astype(np.int64)
+            codes = records['action'].astype(np.int32)
+        else:
+            actions, lookup = [], {}
+            times, codes = [], []
+            for event in self.iter_events():
+                code = lookup.get(event.action)
+                if code is None:
+                    code = lookup[event.action] = len(actions)
+                    actions.append(event.action)
+                times.append(event.time)
+                codes.append(code)
+            times = np.array(times, dtype=np.int64)
+            codes = np.array(codes, dtype=np.int32)
+        # Stable sort by action code, then split into one row array per action
+        order = np.argsort(codes, kind='mergesort')
+        bounds = np.cumsum(np.bincount(codes, minlength=len(actions)))
+        rows = {}
+        for code, group in enumerate(np.split(order, bounds[:-1])):
+            if len(group):
+                rows[actions[code]] = group
+        self._index = {'times': times, 'rows': rows,
+                       'sorted': bool(np.all(times[1:] >= times[:-1]))}
+        return self._index
+
+    def rows_of(self, action):
+        """
+        Return the positions in self.events of all events whose action
+        is action, as an ascending integer array.
+        """
+        return self._build_index()['rows'].get(action, np.empty(0, dtype=np.int64))
+
+    def events_of(self, action):
+        """
+        Return the list of events whose action is action, e.g.
+        trans.events_of(UTTERANCE).
+        """
+        return self._events_at(self.rows_of(action))
+
+    def _events_at(self, rows):
+        """
+        Return the events at the given positions, in the given order. A
+        lazy transcript makes one streaming pass and keeps only those.
+        """
+        if self.events is not None:
+            return [self.events[i] for i in rows]
+        wanted = set(rows.tolist())
+        found = {}
+        if wanted:
+            last = max(wanted)
+            for i, event in enumerate(self.iter_events()):
+                if i in wanted:
+                    found[i] = event
+                if i == last:
+                    break
+        return [found[i] for i in rows]
+
+    def count_by_action(self):
+        """
+        Return a Counter mapping each action to its number of events.
+        """
+        return Counter(dict((action, len(rows)) for action, rows in self._build_index()['rows'].items()))
+
+    def events_between(self, t0, t1, action=None):
+        """
+        Return the events with t0 <= time < t1, optionally restricted to
+        a single action. The time window is located with searchsorted()
+        on the time column (sorted first if the transcript is not).
+        """
+        index = self._build_index()
+        rows = self.rows_of(action) if action is not None else np.arange(len(index['times']))
+        times = index['times'][rows]
+        if not index['sorted']:
+            order = np.argsort(times, kind='mergesort')
+            rows, times = rows[order], times[order]
+        lo, hi = np.searchsorted(times, [t0, t1], side='left')
+        return self._events_at(rows[lo:hi])
+
+    def moves_between(self, t0, t1):
+        """
+        Return the player moves with t0 <= time < t1.
+        """
+        return self.events_between(t0, t1, action=MOVE)
 
 ######################################################################
 
@@ -205,7 +503,7 @@ class Event:
         """
         # Utterances are tokenized using a basic card-aware tokenizer:
         if self.action == UTTERANCE:
-            return Tokenizer().tokenize(self.contents)
+            return TOKENIZER.tokenize(self.contents)
         # Card manipulations return a trip (x-coord, y-coord, card)
         elif self.action in (PICKUP, DROP):
             loc, card = self.contents.split(":")
@@ -236,6 +534,11 @@ class Event:
 
 ######################################################################    
 
+# Number of distinct strings whose tokens are memoized by Tokenizer. The
+# cache is built when this module is imported, so changing this later has
+# no effect.
+TOKENIZER_CACHE_SIZE = 50000
+
 class Tokenizer:
     """
     This is a very basic tokenizer that seeks to keep intact emoticons
@@ -252,6 +555,10 @@ class Tokenizer:
 
     where s is a str or unicode instance. The return value is a list
     of strings or unicode instances.
+
+    The corpus repeats many short messages ("ok", "got it"), so the
+    token lists of the most recent TOKENIZER_CACHE_SIZE distinct strings
+    are memoized. All Tokenizer instances share that cache.
     """
 
     # Emoticon identification:
@@ -294,10 +601,31 @@ class Tokenizer:
 
     # The actual tokenizing regular expression:
     token_re = re.compile(r"(%s)" % "|".join((emoticons, words, ranks, suits, misc_punc)), re.VERBOSE)
+
    
     def tokenize(self, s):
         """
         Tokenize the string s using token_re.findall(). Return value
         is a list of strings or unicode instances.
         """
-        return Tokenizer.token_re.findall(s)
+        # The type is part of the key so that str and unicode inputs
+        # that compare equal still get tokens of their own type back.
+        return list(_findall(s, type(s)))
+
+    def tokenize_many(self, strings):
+        """
+        Tokenize every string in the iterable strings. Return value
+        is a list with one token list per string.
+        """
+        return [list(_findall(s, type(s))) for s in strings]
+
+@lru_cache(maxsize=TOKENIZER_CACHE_SIZE)
+def _findall(s, s_type):
+    """
+    Memoized token_re.findall(); returns a tuple so that cached results
+    cannot be modified by callers.
+    """
+    return tuple(Tokenizer.token_re.findall(s))
+
+# Shared instance used by Event.parse_contents():
+TOKENIZER = Tokenizer()
@@ -0,0 +1,450 @@
+import csv
+import hashlib
+import json
+import mmap
+import numpy as np
+import os
+import sys
+
+from glob import iglob
+from wildcard.util.cards import DROP, INITIAL_LOCATION, MOVE, PICKUP
+from wildcard.util.cards import Event
+
+"""
+Compiled, columnar cache of the Cards corpus transcripts.
+
+The corpus is compiled once with
+
+cache = CorpusCache.compile('transcripts')
+
+which writes every event of every transcript to a directory of typed
+arrays (by default `transcripts/.wildcard_cache`). Agents, actions and
+cards are interned as small integer codes, times and coordinates are
+stored as integer arrays and the raw contents of each event live in a
+single packed byte buffer. Corpus, Transcript and Game pick the cache up
+automatically while it is fresh, i.e. while every source file still has
+the modification time (or, failing that, the content hash) recorded at
+compile time.
+
+The event records and the contents buffer are memory-mapped, so
+EventView objects over them cost a few bytes each no matter how much of
+the corpus is being scanned.
+"""
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIRNAME = ".wildcard_cache"
+MANIFEST = "manifest.json"
+EVENTS = "events.npy"
+TEXT = "text.bin"
+
+# One record per event; contents are text[offset:offset + length]
+EVENT_DTYPE = np.dtype([("agent", np.uint8),
+                        ("time", np.int32),
+                        ("action", np.uint8),
+                        ("offset", np.int64),
+                        ("length", np.int32),
+                        ])
+
+# Column name -> dtype of the remaining per-event arrays
+COLUMNS = [("x", np.int16),
+           ("y", np.int16),
+           ("card", np.int8),
+           ]
+
+# Caches loaded so far, keyed by cache dir, so that building many
+# Transcript/Game objects does not reload the arrays each time
+_loaded_caches = {}
+
+
+def _file_sha1(filename):
+    """
+    Hex SHA-1 digest of the contents of filename
+    """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _intern(vocab, codes, value):
+    """
+    Return the integer code of value, adding it to vocab if unseen
+    """
+    code = codes.get(value)
+    if code is None:
+        code = len(vocab)
+        vocab.append(value)
+        codes[value] = code
+    return code
+
+
+def _parse_location(action, contents):
+    """
+    Extract (x, y, card) from the contents of an event, with -1/None for
+    whatever the action does not carry
+    """
+    try:
+        if action in (MOVE, INITIAL_LOCATION):
+            x, y = contents.split(",")
+            return int(x), int(y), None
+        elif action in (PICKUP, DROP):
+            loc, card = contents.split(":")
+            x, y = loc.split(",")
+            return int(x), int(y), card
+    except ValueError:
+        pass
+    return -1, -1, None
+
+
+class CorpusCache(object):
+    """
+    Read access to a compiled corpus cache
+    """
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: Directory written by CorpusCache.compile()
+        """
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest["version"] != CACHE_VERSION:
+            raise ValueError("Cache in %s has version %s, expected %s" %
+                             (cache_dir, manifest["version"], CACHE_VERSION))
+
+        # json hands back unicode; paths and vocabularies are kept as str
+        self.corpus_dir = manifest["corpus_dir"].encode("utf8")
+        self.files = manifest["files"]
+        for entry in self.files:
+            entry["path"] = entry["path"].encode("utf8")
+        self.agents = [a.encode("utf8") for a in manifest["agents"]]
+        self.actions = [a.encode("utf8") for a in manifest["actions"]]
+        self.cards = [c.encode("utf8") for c in manifest["cards"]]
+
+        self.events = np.load(os.path.join(cache_dir, EVENTS), mmap_mode="r")
+        self.columns = {}
+        for name, _ in COLUMNS + [("transcript_offsets", None)]:
+            self.columns[name] = np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode="r")
+        self._text = None
+
+        self._index = {}
+        for i, entry in enumerate(self.files):
+            self._index[os.path.join(self.corpus_dir, entry["path"])] = i
+
+    @staticmethod
+    def default_dir(corpus_dir):
+        """
+        Location of the cache when none is given explicitly
+        :param corpus_dir: Root of the corpus transcripts
+        :return:
+        """
+        return os.path.join(corpus_dir, DEFAULT_CACHE_DIRNAME)
+
+    @classmethod
+    def compile(cls, corpus_dir, cache_dir=None, display_progress=True):
+        """
+        Parse every transcript under corpus_dir once and write the
+        columnar cache
+        :param corpus_dir: Root of the corpus transcripts
+        :param cache_dir: Where to write the cache (default: CorpusCache.default_dir(corpus_dir))
+        :param display_progress: Write a progress counter to stderr
+        :return: CorpusCache over the freshly written cache
+        """
+        corpus_dir = os.path.abspath(corpus_dir)
+        if cache_dir is None:
+            cache_dir = cls.default_dir(corpus_dir)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        agents, actions, cards = [], [], []
+        agent_codes, action_codes, card_codes = {}, {}, {}
+        events = []
+        columns = dict((name, []) for name, _ in COLUMNS)
+        offset, transcript_offsets = 0, [0]
+        files = []
+
+        manifest_path = os.path.join(cache_dir, MANIFEST)
+        # A stale manifest must not describe the half-written arrays below
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        with open(os.path.join(cache_dir, TEXT), "wb") as text:
+            for trans_no, filename in enumerate(sorted(iglob(os.path.join(corpus_dir, "*/*.csv")))):
+                if display_progress:
+                    sys.stderr.write("\r") ; sys.stderr.write("compiling transcript %s" % (trans_no + 1)) ; sys.stderr.flush()
+                with open(filename, "rb") as f:
+                    for agent, time, action, contents in csv.reader(f):
+                        x, y, card = _parse_location(action, contents)
+                        events.append((_intern(agents, agent_codes, agent), int(time),
+                                       _intern(actions, action_codes, action), offset, len(contents)))
+                        columns["x"].append(x)
+                        columns["y"].append(y)
+                        columns["card"].append(-1 if card is None else _intern(cards, card_codes, card))
+                        text.write(contents)
+                        offset += len(contents)
+
+                transcript_offsets.append(len(events))
+                files.append({"path": os.path.relpath(filename, corpus_dir),
+                              "mtime": os.path.getmtime(filename),
+                              "sha1": _file_sha1(filename)})
+        if display_progress:
+            sys.stderr.write("\n")
+
+        np.save(os.path.join(cache_dir, EVENTS), np.array(events, dtype=EVENT_DTYPE))
+        for name, dtype in COLUMNS:
+            np.save(os.path.join(cache_dir, name + ".npy"), np.array(columns[name], dtype=dtype))
+        np.save(os.path.join(cache_dir, "transcript_offsets.npy"), np.array(transcript_offsets, dtype=np.int64))
+
+        # The manifest goes last: its presence marks a complete cache
+        with open(manifest_path, "w") as f:
+            json.dump({"version": CACHE_VERSION,
+                       "corpus_dir": corpus_dir,
+                       "files": files,
+                       "agents": agents,
+                       "actions": actions,
+                       "cards": cards}, f)
+
+        _loaded_caches.pop(cache_dir, None)
+        return cls(cache_dir)
+
+    @property
+    def text(self):
+        """
+        Packed contents of all events, memory-mapped on first use
+        """
+        if self._text is None:
+            with open(os.path.join(self.cache_dir, TEXT), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # mmap refuses empty files
+                    self._text = b""
+                else:
+                    self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._text
+
+    @property
+    def filenames(self):
+        """
+        Absolute paths of the cached transcripts, in cache order
+        """
+        return [os.path.join(self.corpus_dir, entry["path"]) for entry in self.files]
+
+    def _entry_is_fresh(self, i):
+        """
+        Whether cached transcript i still matches its source file. The
+        mtime is checked first; the content hash decides if it moved.
+        """
+        entry = self.files[i]
+        filename = os.path.join(self.corpus_dir, entry["path"])
+        if not os.path.exists(filename):
+            return False
+        if os.path.getmtime(filename) == entry["mtime"]:
+            return True
+        return _file_sha1(filename) == entry["sha1"]
+
+    def is_fresh(self):
+        """
+        Whether the cache covers exactly the current corpus files and
+        every one of them is unchanged
+        :return:
+        """
+        current = set(os.path.abspath(f) for f in iglob(os.path.join(self.corpus_dir, "*/*.csv")))
+        if current != set(self._index):
+            return False
+        return all(self._entry_is_fresh(i) for i in range(len(self.files)))
+
+    def index_of(self, filename):
+        """
+        Position of filename in the cache, or None if it is not cached
+        or has changed since compilation
+        :param filename: Path of a transcript
+        :return:
+        """
+        i = self._index.get(os.path.abspath(filename))
+        if i is None or not self._entry_is_fresh(i):
+            return None
+        return i
+
+    def __len__(self):
+        return len(self.files)
+
+    def event_range(self, i):
+        """
+        Half-open range of event rows belonging to transcript i
+        """
+        offsets = self.columns["transcript_offsets"]
+        return int(offsets[i]), int(offsets[i + 1])
+
+    def contents(self, row):
+        """
+        Raw contents string of event row
+        """
+        record = self.events[row]
+        start = int(record["offset"])
+        return self.text[start:start + int(record["length"])]
+
+    def iter_rows(self, i, first=0, chunksize=1024):
+        """
+        Yield the events of transcript i as [agent, time, action, contents]
+        lists, the same shape csv.reader produces for the source file
+        :param i: Position of the transcript in the cache
+        :param first: Number of leading events to skip
+        :param chunksize: Number of records converted to Python values at a time
+        :return:
+        """
+        start, stop = self.event_range(i)
+        text = self.text
+        for chunk_start in range(start + first, stop, chunksize):
+            records = self.events[chunk_start:min(chunk_start + chunksize, stop)]
+            for agent, time, action, offset, length in records.tolist():
+                yield [self.agents[agent], time, self.actions[action], text[offset:offset + length]]
+
+    def event_views(self, i):
+        """
+        The events of transcript i as a sequence of EventView objects
+        :param i: Position of the transcript in the cache
+        :return:
+        """
+        start, stop = self.event_range(i)
+        return EventSequence(self, start, stop)
+
+
+class EventView(object):
+    """
+    Read-only stand-in for cards.Event backed by one record of a
+    CorpusCache. Only the cache and the row number are stored; contents
+    are sliced out of the memory-mapped text buffer when asked for.
+    """
+    __slots__ = ("_cache", "_row")
+
+    def __init__(self, cache, row):
+        self._cache = cache
+        self._row = row
+
+    @property
+    def agent(self):
+        return self._cache.agents[self._cache.events[self._row]["agent"]]
+
+    @property
+    def time(self):
+        return int(self._cache.events[self._row]["time"])
+
+    @property
+    def action(self):
+        return self._cache.actions[self._cache.events[self._row]["action"]]
+
+    @property
+    def contents(self):
+        return self._cache.contents(self._row)
+
+    # Same behaviour as the full Event
+    parse_contents = Event.__dict__["parse_contents"]
+    __repr__ = Event.__dict__["__repr__"]
+
+
+class EventSequence(object):
+    """
+    Lazy sequence of EventView objects over a range of cache rows, used
+    in place of Transcript.events
+    """
+    def __init__(self, cache, start, stop):
+        self.cache = cache
+        self.start = start
+        self.stop = stop
+
+    @property
+    def records(self):
+        """
+        The memory-mapped event records covered by this sequence
+        """
+        return self.cache.events[self.start:self.stop]
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("event index out of range")
+        return EventView(self.cache, self.start + k)
+
+    def __iter__(self):
+        for row in range(self.start, self.stop):
+            yield EventView(self.cache, row)
+
+
+def load_cache(corpus_dir, cache_dir=None):
+    """
+    Return the CorpusCache for corpus_dir if one has been compiled, else None.
+    Loaded caches are memoized per cache directory.
+    :param corpus_dir: Root of the corpus transcripts
+    :param cache_dir: Cache location (default: CorpusCache.default_dir(corpus_dir))
+    :return:
+    """
+    if cache_dir is None:
+        cache_dir = CorpusCache.default_dir(corpus_dir)
+    manifest_path = os.path.join(cache_dir, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+
+    mtime = os.path.getmtime(manifest_path)
+    loaded = _loaded_caches.get(cache_dir)
+    if loaded is None or loaded[0] != mtime:
+        try:
+            loaded = (mtime, CorpusCache(cache_dir))
+        except ValueError:
+            # Written by an incompatible version, needs recompiling
+            return None
+        _loaded_caches[cache_dir] = loaded
+    return loaded[1]
+
+
+def find_cached_transcript(filename):
+    """
+    Look for a fresh cache entry for a single transcript in the default
+    cache location of its corpus (transcripts live in <corpus>/*/*.csv)
+    :param filename: Path of a transcript
+    :return: (cache, index) or (None, None)
+    """
+    corpus_dir = os.path.dirname(os.path.dirname(os.path.abspath(filename)))
+    cache = load_cache(corpus_dir)
+    if cache is None:
+        return None, None
+    i = cache.index_of(filename)
+    if i is None:
+        return None, None
+    return cache, i
+
+
+def resolve_cache(filename, cache=None):
+    """
+    Find the fresh cache entry for a transcript
+    :param filename: Path of a transcript
+    :param cache: CorpusCache to use; None looks in the default location,
+                  False disables the cache
+    :return: (cache, index), or (None, None) if there is no fresh entry
+    """
+    if cache is False:
+        return None, None
+    if cache is None:
+        return find_cached_transcript(filename)
+    index = cache.index_of(filename)
+    if index is None:
+        return None, None
+    return cache, index
+
+
+def cached_rows(filename, cache=None):
+    """
+    Rows of a transcript read from a fresh cache entry, or None if there
+    is none and the caller has to parse the CSV file itself
+    :param filename: Path of a transcript
+    :param cache: As for resolve_cache()
+    :return: Iterator over [agent, time, action, contents] lists, or None
+    """
+    cache, index = resolve_cache(filename, cache)
+    if index is None:
+        return None
+    return cache.iter_rows(index)
@@ -10,10 +10,12 @@ random.seed(42)
 
 def split_data(utterances, split=[0.8, 0.2]):
     """
-    Split data into train/test according to provided ratio
+    Split data into train/test according to provided ratio. The caller's
+    list is left in its original order.
     :param split: Split to use for train/test
     :return:
     """
+    utterances = list(utterances)
     random.shuffle(utterances)
     bound = int(len(utterances) * split[0])
     train = utterances[:bound]
@@ -20,6 +20,120 @@ inverse_mapping = {1: "A", 2: "2", 3: "3", 4: "4", 5: "5",
 card_vals = range(1, 14)
 all_strategies = [ set([ x if x <= 13 else x - 13 for x in range(y,y+6) ]) for y in range(1,14) ]
 
+# Cards are also represented as bits of a 52-bit mask, 13 bits per suit
+suit_offsets = {"H": 0, "D": 13, "S": 26, "C": 39}
+# Bit of each card named the way append_suffix() names window cards
+# ("11H", not "JH"), so a hand card lands on a bit exactly when
+# compute_ed() would have matched it against a window by string
+card_bits = dict((str(v) + suit, 1 << (offset + v - 1))
+                 for v in card_vals for suit, offset in suit_offsets.items())
+# Bit of every way a hand card can be written ("AH", "1H", "JH", "11H", ...)
+hand_bits = dict((name + suit, 1 << (offset + v - 1))
+                 for name, v in card_mapping.items() + [(str(v), v) for v in card_vals]
+                 for suit, offset in suit_offsets.items())
+suit_mask = (1 << MAX_CARD) - 1
+# 13-bit value masks of all_strategies, and popcounts of 13-bit masks
+strategy_masks = [sum(1 << (v - 1) for v in strategy) for strategy in all_strategies]
+_popcount13 = [bin(m).count("1") for m in range(1 << MAX_CARD)]
+
+
+class Hand(object):
+    """
+    Set of cards stored as a single 52-bit int: bit offset + value - 1,
+    with the suit offsets in suit_offsets. Convert with Hand.from_cards()
+    and to_cards(); membership, union, intersection, suit filtering and
+    size are all a few int operations.
+    """
+    __slots__ = ("mask",)
+
+    def __init__(self, mask=0):
+        self.mask = mask
+
+    @classmethod
+    def from_cards(cls, cards, strict=True):
+        """
+        Build a hand from card strings, e.g. ["3H", "JS", ""]. Surrounding
+        whitespace and empty strings are ignored.
+        :param cards: Iterable of card strings
+        :param strict: Raise KeyError on an unknown card rather than skip it
+        :return:
+        """
+        mask = 0
+        for card in cards:
+            card = card.strip()
+            if card:
+                if strict:
+                    mask |= hand_bits[card]
+                else:
+                    mask |= hand_bits.get(card, 0)
+        return cls(mask)
+
+    def to_cards(self):
+        """
+        Card strings in the hand, ordered by suit then value, e.g. ["AH", "JH"]
+        :return:
+        """
+        return list(self)
+
+    def __iter__(self):
+        for suit, offset in sorted(suit_offsets.items(), key=lambda item: item[1]):
+            values = (self.mask >> offset) & suit_mask
+            for v in card_vals:
+                if values & (1 << (v - 1)):
+                    yield inverse_mapping[v] + suit
+
+    def __len__(self):
+        return popcount(self.mask)
+
+    def __contains__(self, card):
+        bit = hand_bits.get(card.strip())
+        return bit is not None and bool(self.mask & bit)
+
+    def __or__(self, other):
+        return Hand(self.mask | other.mask)
+
+    def __and__(self, other):
+        return Hand(self.mask & other.mask)
+
+    def __sub__(self, other):
+        return Hand(self.mask & ~other.mask)
+
+    def __eq__(self, other):
+        return isinstance(other, Hand) and self.mask == other.mask
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.mask)
+
+    def suit(self, suit):
+        """
+        The cards of one suit
+        :param suit: "H", "D", "S" or "C"
+        :return: Hand
+        """
+        offset = suit_offsets[suit]
+        return Hand(self.mask & (suit_mask << offset))
+
+    def suits(self):
+        """
+        Set of suits present in the hand
+        :return:
+        """
+        return set(suit for suit, offset in suit_offsets.items() if (self.mask >> offset) & suit_mask)
+
+    def values(self):
+        """
+        13-bit mask of the card values in the hand, regardless of suit
+        :return:
+        """
+        m = self.mask
+        return (m | (m >> 13) | (m >> 26) | (m >> 39)) & suit_mask
+
+    def __repr__(self):
+        return "Hand(%s)" % self.to_cards()
+
 
 def free_hand(hand):
     """
@@ -37,37 +151,61 @@ def free_hand_2(hand):
     space in their hand (i.e. less than 3 of the same suit in a possible
     winning window defined in all_strategies). More complex definition from
     above.
-    :param hand: List of cards in hand
+    :param hand: List of cards in hand, or a Hand
     :return:
     """
     if len(hand) < 3:
         return True
+    if isinstance(hand, Hand):
+        if len(hand.suits()) > 1:
+            return True
+        values = hand.values()
     else:
         suits = set( [card.strip()[-1] for card in hand] )  
-        #print "suits in hand" , suits 
         if len(suits) > 1:
             return True
-        else:
-            # get numbers associated 
-            card_vals = set([ card_mapping[card.strip()[:-1]] for card in hand ])
+        values = Hand.from_cards(hand).values()
 
-            #print "card values" , card_vals
-            strategy_found = True
-            for strategy in all_strategies:
-                if len(strategy.intersection(card_vals)) == 3:
-                    strategy_found = False
-                    break
-            return strategy_found
+    # Not free if 3 of the values fall in one winning window
+    for strategy in strategy_masks:
+        if _popcount13[strategy & values] == 3:
+            return False
+    return True
 
 
-def compute_window(coi):
+def card_type(coi):
     """
-    Compute windows of potential straights around given card.
-    Note suffixes already stripped off
+    Extract card type from card ("H", "C", "D", "S")
     :param coi: Card of interest
+    :return:
+    """
+    return coi[-1]
+
+
+def append_suffix(cards, type):
+    appended = []
+    for c in cards:
+        appended.append(str(c) + type)
+
+    return appended
+
+
+def popcount(mask):
+    """
+    Number of set bits in a card mask
+    :param mask: Non-negative int
+    :return:
+    """
+    return bin(mask).count("1")
+
+
+def _compute_window(card_val):
+    """
+    Compute windows of potential straights around given card value.
+    Only run when building the window tables below.
+    :param card_val: Value of card of interest (1-13)
     :return: Return lists of winnings hands
     """
-    card_val = card_mapping[coi]
     windows = []
     for idx, diff in enumerate(range(-6, 0)):
         # Lower bound of card
@@ -106,32 +244,111 @@ def compute_window(coi):
     return windows
 
 
-def card_type(coi):
+def _window_tables():
     """
-    Extract card type from card ("H", "C", "D", "S")
+    Tables of windows per (card value, suit): each window as a card mask
+    and as the set of card strings compute_ed() returns
+    :return: (window_masks, window_cards)
+    """
+    masks, cards = {}, {}
+    for val, windows in windows_by_val.items():
+        for suit, offset in suit_offsets.items():
+            masks[(val, suit)] = [sum(1 << (offset + v - 1) for v in set(w)) for w in windows]
+            cards[(val, suit)] = [frozenset(append_suffix(w, suit)) for w in windows]
+    return masks, cards
+
+
+# Windows for each card value, computed once at import
+windows_by_val = dict((v, _compute_window(v)) for v in card_vals)
+window_masks, window_cards = _window_tables()
+
+
+def compute_window(coi):
+    """
+    Compute windows of potential straights around given card.
+    Note suffixes already stripped off
     :param coi: Card of interest
-    :return:
+    :return: Return lists of winnings hands
     """
-    return coi[-1]
+    return [list(w) for w in windows_by_val[card_mapping[coi]]]
 
 
-def append_suffix(cards, type):
-    appended = []
+def card_mask(cards):
+    """
+    Card mask of a list of card strings, plus the distinct strings that
+    have no bit (see card_bits)
+    :param cards: List of cards, e.g. ["3H", "4H"]
+    :return: (mask, set of other strings)
+    """
+    mask = 0
+    other = set()
     for c in cards:
-        appended.append(str(c) + type)
-
-    return appended
+        bit = card_bits.get(c)
+        if bit is None:
+            other.add(c)
+        else:
+            mask |= bit
+    return mask, other
 
 
 def compute_ed(hands, coi):
     """
     Compute edit distance for both players given their hands.
+    Works on card masks and the precomputed window tables; returns the
+    same as the set-based _compute_ed_sets().
     :param hands: "Hands" stores cards for each player in dict:
     {"1":[3H,4H,5H], "2":[6H,7H]}
     :param coi: card-of-interest
     :return:
     """
     type = card_type(coi)
+    if type not in suit_offsets:
+        return _compute_ed_sets(hands, coi)
+    card_val = card_mapping[coi.strip("SDCH")]
+    masks = window_masks[(card_val, type)]
+
+    # Clean hands first to clean out empty string
+    hands["1"] = [c for c in hands["1"] if c != ""]
+    hands["2"] = [c for c in hands["2"] if c != ""]
+
+    p1_mask, p1_other = card_mask(hands["1"])
+    p2_mask, p2_other = card_mask(hands["2"])
+    all_mask = p1_mask | p2_mask
+    # Strings without a bit are never in a window, so always overflow
+    num_other = len(p1_other | p2_other)
+
+    min_ed = float("inf")
+    best = None
+    for i, w in enumerate(masks):
+        ed = popcount(all_mask ^ w) + num_other
+        if ed < min_ed:
+            min_ed = ed
+            best = i
+    w = masks[best]
+    optimal_window = set(window_cards[(card_val, type)][best])
+
+    # Given optimal window, compute edit distance for each player
+    p1_inter = popcount(p1_mask & w)
+    p1_diff = popcount(p1_mask & ~w) + len(p1_other)
+    p1_edit = 2 * p1_diff + (3 - p1_diff - p1_inter)
+
+    p2_inter = popcount(p2_mask & w)
+    p2_diff = popcount(p2_mask & ~w) + len(p2_other)
+    p2_edit = 2 * p2_diff + (3 - p2_diff - p2_inter)
+
+    # All cards in window iff none fall outside it
+    return optimal_window, min_ed, p1_edit, p2_edit, [p1_diff == 0, p2_diff == 0]
+
+
+def _compute_ed_sets(hands, coi):
+    """
+    Set-based reference implementation of compute_ed(), also used for
+    cards of interest whose suffix is not a suit.
+    :param hands: As for compute_ed()
+    :param coi: card-of-interest
+    :return:
+    """
+    type = card_type(coi)
     coi = coi.strip("SDCH")
     windows = compute_window(coi)
 
@@ -189,12 +406,7 @@ def mentions_cards(utterance, tokenizer, card_expressions):
    :return: Bool whether any of `card expressions` is contained in utt.
    """
    tokens = set(tokenizer.tokenize(utterance.lower()))
-   for c in card_expressions:
-      if c in tokens:
-         contains_cref = True
-         return contains_cref
-
-   return False
+   return not tokens.isdisjoint(card_expressions)
 
 
 def card_expressions():
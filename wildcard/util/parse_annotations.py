@@ -1,4 +1,8 @@
+import cPickle as pickle
 import csv
+import hashlib
+import logging
+import multiprocessing
 import os
 import re
 
@@ -6,6 +10,11 @@ import re
 Utilities for parsing our transcript annotations
 """
 
+logger = logging.getLogger(__name__)
+
+# Bump when the parsed format changes, to invalidate cached parses
+PARSE_CACHE_VERSION = 3
+
 columns = ["P1_HAND", "P2_HAND", "P1_LOC", "P2_LOC", "P1_KNOW", "P2_KNOW",
             "P1_NEED", "P2_NEED", "P1_ABLE", "P2_ABLE", "CARD_LOC", "POINTER"]
 
@@ -92,51 +101,212 @@ def parse_line(line):
     return ex
 
 
-def parse_annotation_file(file_path):
+class DialogueBuffer(object):
     """
-    Parse given annotation file path
-    :param file_path: Parse all lines in given file
-    :return:
+    Chat messages of one annotation file, in order, shared by the
+    DialogueContext of every example parsed from it
+    """
+    def __init__(self):
+        self.turns = []
+
+    def __len__(self):
+        return len(self.turns)
+
+    def append(self, message):
+        self.turns.append(message)
+
+
+class DialogueContext(object):
+    """
+    Dialogue context of an example: the turns of a DialogueBuffer before
+    end, or only the last window of them. str() gives the text, each turn
+    followed by a space; see dialogue_text().
+    """
+    __slots__ = ("buffer", "end", "window")
+
+    def __init__(self, buffer, end, window=None):
+        """
+        :param buffer: DialogueBuffer of the example's file
+        :param end: Number of turns up to and including the example's message
+        :param window: Keep only this many of the most recent turns (default: all)
+        """
+        self.buffer = buffer
+        self.end = end
+        self.window = window
+
+    @property
+    def start(self):
+        if self.window is None:
+            return 0
+        return max(0, self.end - self.window)
+
+    def turns(self):
+        return self.buffer.turns[self.start:self.end]
+
+    def __str__(self):
+        return "".join(turn + " " for turn in self.turns())
+
+    def __repr__(self):
+        return "DialogueContext(%r)" % str(self)
+
+
+def dialogue_text(ex):
+    """
+    Text of an example's dialogue context, each turn followed by a space.
+    Built on each call; examples only keep their DialogueContext.
+    :param ex: Example dict from parse_annotation_lines(), or one built by
+               hand with a DIALOGUE string
+    :return: String
+    """
+    if "DIALOGUE_CONTEXT" in ex:
+        return str(ex["DIALOGUE_CONTEXT"])
+    return ex["DIALOGUE"]
+
+
+def parse_annotation_lines(lines, window=None, verbose=True, name=None):
+    """
+    Parse the lines of an annotation file
+    :param lines: Iterable of lines of the file
+    :param window: Number of most recent turns kept in each example's
+                   DIALOGUE_CONTEXT (default: the whole dialogue so far)
+    :param verbose: Print every example; otherwise log them at DEBUG level
+    :param name: Name of the file; its base name is stored as each
+                 example's TRANSCRIPT, to group examples by game
+    :return: List of examples. DIALOGUE_CONTEXT is a DialogueContext of
+             the dialogue so far; dialogue_text() gives its text.
     """
     utterances = []
-    with open(file_path) as f:
-        reader = csv.reader(f, delimiter=",")
-        dialogue = ""
-        for idx, line in enumerate(reader):
-            if line[-1] != "" and line[-1].lower() != "pointer":
+    reader = csv.reader(lines, delimiter=",")
+    dialogue = DialogueBuffer()
+    for idx, line in enumerate(reader):
+        if line[-1] != "" and line[-1].lower() != "pointer":
+            if verbose:
                 print "Good line: ", idx, " ", line[4:]
-                ex = parse_line(line)
+            ex = parse_line(line)
+            ex["TRANSCRIPT"] = os.path.basename(name) if name is not None else None
+            if verbose:
                 print "Ex: ", ex, " COI: ", ex["COI"]
-                # Add dialogue context to ex, including current chat message
-                dialogue += line[3] + " "
-                ex["DIALOGUE"] = dialogue
+            else:
+                logger.debug("example file=%s line=%d speaker=%s coi=%s pointer=%d",
+                             name, idx, ex["SPEAKER"], ex["COI"], ex["POINTER"])
+            # Add dialogue context to ex, including current chat message
+            dialogue.append(line[3])
+            ex["DIALOGUE_CONTEXT"] = DialogueContext(dialogue, len(dialogue), window)
+            if verbose:
                 print "\n"
-                utterances.append(ex)
-            elif line[2] == "CHAT_MESSAGE_PREFIX":
-                # Append utterance to dialogue context
-                dialogue += line[3] + " "
+            utterances.append(ex)
+        elif line[2] == "CHAT_MESSAGE_PREFIX":
+            # Append utterance to dialogue context
+            dialogue.append(line[3])
 
     return utterances
 
 
-def parse_all(annotation_dir):
+def _set_window(utterances, window):
     """
-    Parse all annotations in dir
-    :param annotation_dir: Data dir to parse
+    Set the window of the dialogue contexts of examples
+    """
+    for ex in utterances:
+        ex["DIALOGUE_CONTEXT"].window = window
+
+
+def parse_annotation_file(file_path, window=None, verbose=True):
+    """
+    Parse given annotation file path
+    :param file_path: Parse all lines in given file
+    :param window: See parse_annotation_lines()
+    :param verbose: See parse_annotation_lines()
     :return:
     """
-    utterances = []
-    for file in os.listdir(annotation_dir):
-        if not file.endswith("DS_Store"):
-            print "File: ", file
-            file_path = os.path.join(annotation_dir, file)
-            utterance = parse_annotation_file(file_path)
-            utterances.extend(utterance)
+    with open(file_path) as f:
+        return parse_annotation_lines(f, window, verbose, file_path)
 
-    print "Utterances: ", len(utterances)
-    return utterances
 
+def load_annotation_file(file_path, cache_dir=None, window=None, verbose=True):
+    """
+    Parse an annotation file, going through an on-disk cache of parses
+    keyed by the SHA-1 of the file contents, so an unchanged file is
+    never parsed twice
+    :param file_path: Annotation file
+    :param cache_dir: Directory of cached parses (default: no caching)
+    :param window: See parse_annotation_lines()
+    :param verbose: See parse_annotation_lines()
+    :return: (list of examples, whether they came from the cache)
+    """
+    if cache_dir is None:
+        return parse_annotation_file(file_path, window, verbose), False
 
+    with open(file_path, "rb") as f:
+        contents = f.read()
+    key = hashlib.sha1("%d:" % PARSE_CACHE_VERSION + contents).hexdigest()
+    cache_path = os.path.join(cache_dir, key + ".pkl")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            utterances = pickle.load(f)
+        for ex in utterances:
+            ex["TRANSCRIPT"] = os.path.basename(file_path)
+        _set_window(utterances, window)
+        return utterances, True
 
+    utterances = parse_annotation_lines(contents.splitlines(True), None, verbose, file_path)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Created by another worker in the meantime
+            if not os.path.isdir(cache_dir):
+                raise
+    tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        pickle.dump(utterances, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, cache_path)
+    _set_window(utterances, window)
+    return utterances, False
 
 
+def _load_annotation_file(args):
+    """
+    Pool worker for parse_all()
+    """
+    file_path, cache_dir, window, verbose = args
+    if verbose:
+        print "File: ", os.path.basename(file_path)
+    return (file_path,) + load_annotation_file(file_path, cache_dir, window, verbose)
+
+
+def parse_all(annotation_dir, window=None, processes=1, cache_dir=None, verbose=True):
+    """
+    Parse all annotations in dir
+    :param annotation_dir: Data dir to parse
+    :param window: See parse_annotation_lines()
+    :param processes: Number of worker processes parsing files in
+                      parallel; None uses every core (default: 1)
+    :param cache_dir: Directory of cached parses, see load_annotation_file()
+                      (default: no caching)
+    :param verbose: Print every file and example; otherwise log one
+                    INFO record per file and DEBUG records per example
+    :return:
+    """
+    jobs = [(os.path.join(annotation_dir, file), cache_dir, window, verbose)
+            for file in os.listdir(annotation_dir) if not file.endswith("DS_Store")]
+    pool = None
+    if processes == 1:
+        results = (_load_annotation_file(job) for job in jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_load_annotation_file, jobs)
+
+    utterances = []
+    try:
+        for file_path, utterance, cached in results:
+            logger.info("parsed file=%s utterances=%d cached=%s", file_path, len(utterance), cached)
+            utterances.extend(utterance)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if verbose:
+        print "Utterances: ", len(utterances)
+    logger.info("parsed dir=%s files=%d utterances=%d", annotation_dir, len(jobs), len(utterances))
+    return utterances